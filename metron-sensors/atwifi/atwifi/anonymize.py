@@ -0,0 +1,101 @@
+#
+# Copyright (c) 2018 by Armored Things, Inc.  All rights reserved.
+#
+
+import hmac
+import time
+import hashlib
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+ANON_MODES = ('hmac', 'bcrypt')
+
+
+class PseudonymCache(object):
+    """
+    A bounded cache of mac address to pseudonym, approximately least recently used.  Entries are kept in two
+    generations of plain dicts; a hit in the old generation moves the entry to the new one, and once the new
+    generation is half the size of the cache, the old one is dropped.  An entry older than ttl seconds is
+    computed again, so devices that have left don't stay resident forever.
+    """
+
+    def __init__(self, size=65536, ttl=3600):
+        self.size = size
+        self.ttl = ttl
+        self.current = {}
+        self.previous = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, mac, now):
+        entry = self.current.get(mac)
+        if entry is None:
+            entry = self.previous.pop(mac, None)
+            if entry is not None:
+                self._insert(mac, entry)
+
+        if entry is None or (self.ttl > 0 and now - entry[1] > self.ttl):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return entry[0]
+
+    def put(self, mac, pseudonym, now):
+        self.previous.pop(mac, None)
+        self._insert(mac, (pseudonym, now))
+
+    def _insert(self, mac, entry):
+        if len(self.current) >= self.size // 2:
+            self.previous = self.current
+            self.current = {}
+        self.current[mac] = entry
+
+    def __len__(self):
+        return len(self.current) + len(self.previous)
+
+
+class MacAnonymizer(object):
+    """
+    Replaces mac addresses with pseudonyms.  In hmac mode, the pseudonym is the HMAC-SHA256 of the mac address
+    with a secret key, which takes microseconds.  In bcrypt mode, it is the bcrypt hash of the mac address with
+    a salt, whose cost grows exponentially with the salt's cost factor.  Either way, pseudonyms are cached, so a
+    device seen again in a later scan costs nothing.
+    """
+
+    def __init__(self, mode='hmac', key=None, salt=None, cache_size=65536, cache_ttl=3600):
+        if mode not in ANON_MODES:
+            raise ValueError('anon_mode must be one of %s, not %s' % (', '.join(ANON_MODES), mode))
+
+        # Pseudonyms from a random key would only match within this process, and never across scanners.
+        if mode == 'hmac' and not key:
+            raise ValueError('anon_mode hmac needs an anon_key, the same secret on every scanner')
+
+        self.mode = mode
+        self.salt = salt
+        self.key = key
+        if isinstance(self.key, unicode):
+            self.key = self.key.encode('utf-8')
+
+        self.cache = PseudonymCache(cache_size, cache_ttl) if cache_size > 0 else None
+
+    def hash(self, mac):
+        if self.mode == 'hmac':
+            return hmac.new(self.key, mac.lower().encode('utf-8'), hashlib.sha256).hexdigest()
+
+        import bcrypt
+        if isinstance(mac, unicode):
+            mac = mac.encode('utf-8')
+        return bcrypt.hashpw(mac, self.salt)
+
+    def pseudonym(self, mac):
+        if self.cache is None:
+            return self.hash(mac)
+
+        now = time.time()
+        pseudonym = self.cache.get(mac, now)
+        if pseudonym is None:
+            pseudonym = self.hash(mac)
+            self.cache.put(mac, pseudonym, now)
+        return pseudonym
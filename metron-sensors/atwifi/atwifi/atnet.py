@@ -4,11 +4,11 @@
 
 import json
 import pytz
-import bcrypt
 import socket
 
 from addict import Dict
 from atsensor import AtSensor
+from anonymize import MacAnonymizer
 
 from datetime import datetime, timedelta
 from apscheduler.schedulers.background import BackgroundScheduler
@@ -44,6 +44,13 @@ class AtNet(AtSensor):
         self.maximum_rssi = self.cget('maximum_rssi')
 
         self.salt = self.cget('anon_salt', '$2a$31$FWpEhDxhvvb.g2/S6xrcKe')
+        # hmac is fast enough to anonymize every device in every scan; bcrypt keeps the pseudonyms of old.
+        self.anon_mode = self.cget('anon_mode', 'bcrypt')
+        self.anonymizer = None
+        if self.anonymize:
+            self.anonymizer = MacAnonymizer(self.anon_mode, key=self.cget('anon_key'), salt=self.salt,
+                                            cache_size=int(self.cget('anon_cache_size', 65536)),
+                                            cache_ttl=int(self.cget('anon_cache_ttl', 3600)))
         self.jobs = []
         self.devices = []
         self.scheduler = BackgroundScheduler()
@@ -54,7 +61,7 @@ class AtNet(AtSensor):
     def _anonymize_mac(self, mac, package):
 
         if self.anonymize:
-            package['mac'] = bcrypt.hashpw(mac, self.salt)
+            package['mac'] = self.anonymizer.pseudonym(mac)
         else:
             package['mac'] = mac
 
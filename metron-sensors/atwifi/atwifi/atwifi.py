@@ -8,18 +8,74 @@ import threading
 import netifaces
 import traceback
 import subprocess
+from collections import deque
 from addict import Dict
 from dev_utils import get_device_data
 from atnet import AtNet
-from wifi_constants import manufacturer_oui_prefixes, cellphone_manufacturers
+from oui import oui_vendor, oui_prefix, cellphone_prefixes
 from logging import getLogger
 
 logger = getLogger(__name__)
 
 
+class RssiAggregate(object):
+    """
+    The running aggregate of the rssi readings of one mac address, updated in place as each reading arrives.
+    """
+    __slots__ = ('count', 'total', 'first', 'last', 'max', 'min')
+
+    def __init__(self, rssi):
+        self.count = 1
+        self.total = rssi
+        self.first = rssi
+        self.last = rssi
+        self.max = rssi
+        self.min = rssi
+
+    def add(self, rssi):
+        self.count += 1
+        self.total += rssi
+        self.last = rssi
+        if rssi > self.max:
+            self.max = rssi
+        if rssi < self.min:
+            self.min = rssi
+
+    @property
+    def mean(self):
+        return float(self.total) / float(self.count)
+
+
+class RssiVarianceAggregate(RssiAggregate):
+    """
+    A running aggregate that also tracks the variance of the readings, using Welford's method so it stays
+    accurate without keeping the readings.
+    """
+    __slots__ = ('running_mean', 'm2')
+
+    def __init__(self, rssi):
+        super(RssiVarianceAggregate, self).__init__(rssi)
+        self.running_mean = rssi
+        self.m2 = 0.0
+
+    def add(self, rssi):
+        super(RssiVarianceAggregate, self).add(rssi)
+        delta = rssi - self.running_mean
+        self.running_mean += delta / self.count
+        self.m2 += delta * (rssi - self.running_mean)
+
+    @property
+    def variance(self):
+        return self.m2 / self.count
+
+
 class AtWifi(AtNet):
-    COLLECTION_FORMAT = "{tshark} -I -i {adapter} -a duration:{scantime} -w {tmpfile}"
-    PROCESS_FORMAT = "{tshark} -r {tmpfile} -T fields -e wlan.sa -e wlan.bssid -e radiotap.dbm_antsignal"
+    # a single tshark captures for the whole scan, printing the fields of each frame as it is captured
+    COLLECTION_FORMAT = "{tshark} -I -i {adapter} -a duration:{scantime} -l -T fields -e wlan.sa -e wlan.bssid " \
+                        "-e radiotap.dbm_antsignal"
+
+    # how many unparsed lines of tshark output to keep for reporting errors
+    ERROR_LINES = 20
 
     def __init__(self, name, agent_id, description=None, broker_url=None, zookeeper_url=None):
         super(AtWifi, self).__init__(name, agent_id, description, broker_url, zookeeper_url)
@@ -31,6 +87,9 @@ class AtWifi(AtNet):
                 self.tshark = tshark
         if self.tshark is None:
             raise RuntimeError('No Tshark installed in PATH')
+
+        # If set, each entry also carries the variance of its rssi readings.
+        self.rssi_variance = self.cget('rssi_variance', False)
         logger.debug('AtWifi initted')
 
     @staticmethod
@@ -51,8 +110,42 @@ class AtWifi(AtNet):
             rssi = float(data[0])
         return machine_address, rssi
 
+    def read_rssi(self, lines, unparsed=None):
+        """
+        Aggregate the rssi readings of each cellphone's mac address as the lines of tshark output arrive, so
+        nothing grows with the length of the scan but the number of cellphones.  Mac addresses of any other
+        vendor are dropped as they are read.
+
+        Args:
+            lines: an iterable of tshark output lines
+            unparsed: if given, a deque that keeps the lines that are not readings
+
+        Returns:
+            a dict of mac address to the RssiAggregate of its rssi readings
+
+        """
+        aggregate = RssiVarianceAggregate if self.rssi_variance else RssiAggregate
+        cellphones = cellphone_prefixes()
+        mac_addrs = dict()
+        for line in lines:
+            mac, rssi = self.get_mac_addr(line.decode('utf-8').strip())
+
+            if mac is None:
+                if unparsed is not None:
+                    unparsed.append(line)
+                continue
+
+            readings = mac_addrs.get(mac)
+            if readings is not None:
+                readings.add(rssi)
+            elif oui_prefix(mac) in cellphones:
+                mac_addrs[mac] = aggregate(rssi)
+
+        return mac_addrs
+
     def scan(self, **kwargs):
         """
+        Capture for scan_time seconds, parsing each frame as tshark prints it.
 
         Args:
             **kwargs:
@@ -60,53 +153,38 @@ class AtWifi(AtNet):
         Returns:
 
         """
-        arguments = dict(tmpfile='/tmp/tshark_%s_%s.output' % (os.getpid(), kwargs.get('private')),
-                         tshark=self.tshark, scantime=self.scan_time, adapter=kwargs.get('private'))
+        arguments = dict(tshark=self.tshark, scantime=self.scan_time, adapter=kwargs.get('private'))
         collection = self.COLLECTION_FORMAT.format(**arguments).split()
-        analysis = self.PROCESS_FORMAT.format(**arguments).split()
 
         timer = threading.Thread(target=time.sleep, args=(self.scan_time,))
         timer.daemon = True
         timer.start()
-        run_tshark = subprocess.Popen(collection, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        stdout, errors = run_tshark.communicate()
+        run_tshark = subprocess.Popen(collection, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, bufsize=1)
+        unparsed = deque(maxlen=self.ERROR_LINES)
+        try:
+            # readline, unlike iterating the file, does not wait to fill a read-ahead buffer
+            mac_addrs = self.read_rssi(iter(run_tshark.stdout.readline, b''), unparsed)
+            run_tshark.wait()
+        finally:
+            if run_tshark.poll() is None:
+                run_tshark.kill()
+                run_tshark.wait()
         timer.join()
         rc = run_tshark.returncode
-        logger.debug('thark collection returned %s, output lenght is %s', rc, -1 if stdout is None else len(stdout))
+        logger.debug('thark collection returned %s, %s cellphones seen', rc, len(mac_addrs))
         if rc != 0:
-            logger.error('Tshark error %s\n---stdout:\n%s\n---stderr:\n%s', rc, stdout, errors)
+            logger.error('Tshark error %s\n---output:\n%s', rc, ''.join(unparsed))
             return
 
-        run_tshark = subprocess.Popen(analysis, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        output, errors = run_tshark.communicate()
-        rc = run_tshark.returncode
-        logger.debug('thark analysis returned %s, output length is %s', rc, -1 if output is None else len(output))
-        if rc != 0:
-            logger.error('Tshark error %s\n---stdout:\n%s\n---stderr:\n%s', rc, stdout, errors)
-            return
-
-        mac_addrs = dict()
-        for line in output.decode('utf-8').split('\n'):
-            mac, rssi = self.get_mac_addr(line.strip())
-
-            if mac is None:
-                continue
-            # Save the rssi's as a list so we can average them if we get multiple readings.
-            if mac not in mac_addrs:
-                mac_addrs[mac] = [rssi]
-            else:
-                mac_addrs[mac].append(rssi)
-
         package = []
-        for mac, rssi_list in mac_addrs.items():
-            prefix = mac[:8]
-            oui_id = manufacturer_oui_prefixes.get(prefix)
-            if oui_id in cellphone_manufacturers:
-                entry = dict(company=oui_id, rssi=float(sum(rssi_list)) / float(len(rssi_list)),
-                             rssi_first=rssi_list[0], rssi_last=rssi_list[-1], scan_time=self.scan_time,
-                             rssi_max=max(rssi_list), rssi_min=min(rssi_list))
-                self._anonymize_mac(mac, entry)
-                package.append(entry)
+        for mac, readings in mac_addrs.items():
+            entry = dict(company=oui_vendor(mac), rssi=readings.mean,
+                         rssi_first=readings.first, rssi_last=readings.last, scan_time=self.scan_time,
+                         rssi_max=readings.max, rssi_min=readings.min)
+            if self.rssi_variance:
+                entry['rssi_variance'] = readings.variance
+            self._anonymize_mac(mac, entry)
+            package.append(entry)
 
         return package
 
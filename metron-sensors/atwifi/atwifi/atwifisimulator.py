@@ -11,7 +11,6 @@ import subprocess
 from addict import Dict
 from dev_utils import get_device_data
 from atnet import AtNet
-from wifi_constants import manufacturer_oui_prefixes, cellphone_manufacturers
 from logging import getLogger
 
 logger = getLogger(__name__)
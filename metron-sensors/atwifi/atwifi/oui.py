@@ -0,0 +1,261 @@
+#
+# Copyright (c) 2018 by Armored Things, Inc.  All rights reserved.
+#
+
+import os
+import mmap
+import stat
+import struct
+import tempfile
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+# The index is built from the table in wifi_constants, the first time it is needed, and memory mapped from then on.
+INDEX_NAME = 'oui.idx'
+INDEX_MAGIC = 'OUI1'
+
+# magic, number of prefixes, number of vendors
+HEADER = struct.Struct('<4sII')
+PREFIX = struct.Struct('<I')
+VENDOR_ID = struct.Struct('<H')
+VENDOR_OFFSET = struct.Struct('<I')
+
+cellphone_manufacturers = [
+    'Motorola Mobility LLC, a Lenovo Company',
+    'GUANGDONG OPPO MOBILE TELECOMMUNICATIONS CORP.,LTD',
+    'Huawei Symantec Technologies Co.,Ltd.',
+    'Microsoft',
+    'HTC Corporation',
+    'Samsung Electronics Co.,Ltd',
+    'SAMSUNG ELECTRO-MECHANICS(THAILAND)',
+    'BlackBerry RTS',
+    'LG ELECTRONICS INC',
+    'Apple, Inc.',
+    'LG Electronics',
+    'OnePlus Tech (Shenzhen) Ltd',
+    'Xiaomi Communications Co Ltd',
+    'LG Electronics (Mobile Communications)']
+
+
+def oui_prefix(mac):
+    """
+    The 24 bit integer prefix of a mac address, e.g. 0xf0dbe2 for f0:db:e2:01:02:03.
+
+    Args:
+        mac: a mac address, as six pairs of hex digits separated by colons
+
+    Returns:
+        the prefix, or None if the mac address is malformed
+
+    """
+    try:
+        return int(mac[0:2], 16) << 16 | int(mac[3:5], 16) << 8 | int(mac[6:8], 16)
+    except (ValueError, TypeError):
+        return None
+
+
+def build_index(path, oui_prefixes=None):
+    """
+    Write the OUI table as a sorted binary index: the header, then every prefix as an integer in ascending
+    order, then the vendor id of each prefix, then the offset of each vendor name, then the names themselves.
+
+    Args:
+        path: where to write the index; it is written to a temporary file first, then renamed into place
+        oui_prefixes: a dict of "xx:xx:xx" prefix to vendor name; by default, the table in wifi_constants
+
+    Returns:
+
+    """
+    if oui_prefixes is None:
+        from wifi_constants import manufacturer_oui_prefixes
+        oui_prefixes = manufacturer_oui_prefixes
+
+    vendors = sorted(set(oui_prefixes.values()))
+    vendor_ids = dict((vendor, idx) for idx, vendor in enumerate(vendors))
+    prefixes = sorted((oui_prefix(prefix), vendor_ids[vendor]) for prefix, vendor in oui_prefixes.items())
+
+    chunks = [HEADER.pack(INDEX_MAGIC, len(prefixes), len(vendors))]
+    chunks.extend(PREFIX.pack(prefix) for prefix, _ in prefixes)
+    chunks.extend(VENDOR_ID.pack(vendor_id) for _, vendor_id in prefixes)
+    offset = 0
+    for vendor in vendors:
+        chunks.append(VENDOR_OFFSET.pack(offset))
+        offset += len(vendor)
+    chunks.append(VENDOR_OFFSET.pack(offset))
+    chunks.extend(vendors)
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.')
+    with os.fdopen(fd, 'wb') as _f:
+        _f.write(''.join(chunks))
+    os.chmod(tmp_path, 0644)
+    os.rename(tmp_path, path)
+    logger.debug('Built OUI index %s with %s prefixes and %s vendors', path, len(prefixes), len(vendors))
+
+
+class OuiIndex(object):
+    """
+    A memory mapped OUI index, searched by binary search on the integer prefix.  Nothing is parsed when it is
+    opened, and the pages are shared by every process that maps the same file.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as _f:
+            self.mm = mmap.mmap(_f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.count, self.vendors = HEADER.unpack_from(self.mm, 0)
+        if magic != INDEX_MAGIC:
+            self.mm.close()
+            raise ValueError('%s is not an OUI index' % path)
+
+        self.prefixes_at = HEADER.size
+        self.vendor_ids_at = self.prefixes_at + self.count * PREFIX.size
+        self.offsets_at = self.vendor_ids_at + self.count * VENDOR_ID.size
+        self.names_at = self.offsets_at + (self.vendors + 1) * VENDOR_OFFSET.size
+
+    def find(self, prefix):
+        """
+        Returns the position of a prefix in the index, or -1 if it is not there.
+        """
+        unpack_from, mm, prefixes_at, size = PREFIX.unpack_from, self.mm, self.prefixes_at, PREFIX.size
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            value = unpack_from(mm, prefixes_at + mid * size)[0]
+            if value < prefix:
+                lo = mid + 1
+            elif value > prefix:
+                hi = mid
+            else:
+                return mid
+        return -1
+
+    def vendor_id(self, prefix):
+        """
+        Returns the id of the vendor of a prefix, or None if the prefix is unknown.
+        """
+        idx = self.find(prefix)
+        if idx < 0:
+            return None
+        return VENDOR_ID.unpack_from(self.mm, self.vendor_ids_at + idx * VENDOR_ID.size)[0]
+
+    def vendor_name(self, vendor_id):
+        start, end = struct.unpack_from('<II', self.mm, self.offsets_at + vendor_id * VENDOR_OFFSET.size)
+        return self.mm[self.names_at + start:self.names_at + end]
+
+    def find_vendor(self, name):
+        """
+        Returns the id of a vendor, by binary search on the sorted vendor names, or None if it is unknown.
+        """
+        lo, hi = 0, self.vendors
+        while lo < hi:
+            mid = (lo + hi) // 2
+            value = self.vendor_name(mid)
+            if value < name:
+                lo = mid + 1
+            elif value > name:
+                hi = mid
+            else:
+                return mid
+        return None
+
+    def vendor_prefixes(self, names):
+        """
+        Returns the set of integer prefixes that belong to any of the named vendors.
+        """
+        vendor_ids = set(self.find_vendor(name) for name in names)
+        prefixes = struct.unpack_from('<%dI' % self.count, self.mm, self.prefixes_at)
+        ids = struct.unpack_from('<%dH' % self.count, self.mm, self.vendor_ids_at)
+        return frozenset(prefix for prefix, vendor_id in zip(prefixes, ids) if vendor_id in vendor_ids)
+
+    def get(self, mac):
+        """
+        Returns the vendor of a mac address, or None if its prefix is unknown.
+        """
+        prefix = oui_prefix(mac)
+        vendor_id = self.vendor_id(prefix) if prefix is not None else None
+        if vendor_id is None:
+            return None
+        return self.vendor_name(vendor_id)
+
+    def close(self):
+        self.mm.close()
+
+
+def index_path():
+    """
+    The index lives next to this module, unless that directory cannot be written to, in which case it lives
+    in a cache directory that only the current user can write to.
+    """
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    if os.access(package_dir, os.W_OK):
+        return os.path.join(package_dir, INDEX_NAME)
+
+    cache_dir = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'atwifi')
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir, 0700)
+    return os.path.join(cache_dir, INDEX_NAME)
+
+
+def is_trusted(path):
+    """
+    An index can only be trusted if it belongs to the current user and no one else can write to it, so that
+    another user cannot plant one to spoof vendor lookups.
+    """
+    st = os.stat(path)
+    return st.st_uid == os.getuid() and not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
+def is_stale(path):
+    """
+    The index must be rebuilt if it is missing, cannot be trusted or is older than the table it is built from.
+    """
+    source = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'wifi_constants.py')
+    if not os.path.exists(path):
+        return True
+    if not is_trusted(path):
+        logger.warning('Not using OUI index %s, which belongs to another user or is writable by others', path)
+        return True
+    return os.path.exists(source) and os.path.getmtime(source) > os.path.getmtime(path)
+
+
+_index = None
+
+
+def open_index():
+    """
+    Opens the index the first time it is needed, building it if need be.
+    """
+    global _index
+    if _index is None:
+        path = index_path()
+        if is_stale(path):
+            build_index(path)
+        _index = OuiIndex(path)
+    return _index
+
+
+def oui_vendor(mac):
+    """
+    The vendor of a mac address, or None if its prefix is unknown.
+    """
+    return open_index().get(mac)
+
+
+_cellphone_prefixes = None
+
+
+def cellphone_prefixes():
+    """
+    The integer prefixes of every cellphone manufacturer, computed once, so telling whether a mac address
+    belongs to a cellphone is a single set membership test rather than comparing vendor names.
+    """
+    global _cellphone_prefixes
+    if _cellphone_prefixes is None:
+        _cellphone_prefixes = open_index().vendor_prefixes(cellphone_manufacturers)
+    return _cellphone_prefixes
+
+
+if __name__ == '__main__':
+    # prebuild the index, e.g. when installing, so the first scan doesn't have to
+    build_index(index_path())
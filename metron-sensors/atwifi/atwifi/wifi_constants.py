@@ -1,20 +1,7 @@
 
 
-cellphone_manufacturers = [
-    'Motorola Mobility LLC, a Lenovo Company',
-    'GUANGDONG OPPO MOBILE TELECOMMUNICATIONS CORP.,LTD',
-    'Huawei Symantec Technologies Co.,Ltd.',
-    'Microsoft',
-    'HTC Corporation',
-    'Samsung Electronics Co.,Ltd',
-    'SAMSUNG ELECTRO-MECHANICS(THAILAND)',
-    'BlackBerry RTS',
-    'LG ELECTRONICS INC',
-    'Apple, Inc.',
-    'LG Electronics',
-    'OnePlus Tech (Shenzhen) Ltd',
-    'Xiaomi Communications Co Ltd',
-    'LG Electronics (Mobile Communications)']
+# The source of the OUI index built by oui.py; import from oui rather than parsing this module at startup.
+from oui import cellphone_manufacturers
 
 
 manufacturer_oui_prefixes = {
@@ -0,0 +1,91 @@
+#
+# Copyright (c) 2018 by Armored Things, Inc.  All rights reserved.
+#
+"""
+Measures the cost of anonymizing the mac addresses of a venue over several
+scan cycles, with bcrypt versus HMAC-SHA256, each with and without the cache
+of pseudonyms.  In each cycle, most devices were also seen in the previous one.
+
+bcrypt takes twice as long with each increment of its cost factor, so it is
+measured at a low cost and the time at the cost of the configured salt is
+extrapolated from that.
+
+    python benchmarks/anonymize.py --devices 20000 --cycles 12 --repeat-rate 0.8
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'atwifi'))
+from anonymize import MacAnonymizer
+
+# the cost factor of the default salt
+SALT_COST = 31
+
+
+def cycles(devices, count, repeat_rate, seed=1):
+    """ Returns the mac addresses seen in each cycle; each cycle keeps 'repeat_rate' of the previous one. """
+
+    rand = random.Random(seed)
+
+    def mac():
+        return u'f0:db:e2:%02x:%02x:%02x' % (rand.randrange(256), rand.randrange(256), rand.randrange(256))
+
+    seen = [mac() for _ in range(devices)]
+    result = [seen]
+    for _ in range(count - 1):
+        seen = rand.sample(seen, int(devices * repeat_rate))
+        seen += [mac() for _ in range(devices - len(seen))]
+        result.append(seen)
+    return result
+
+
+def run(anonymizer, macs_per_cycle):
+    """ Anonymizes every mac address of every cycle and returns (hashes, seconds). """
+
+    start = time.time()
+    for macs in macs_per_cycle:
+        for mac in macs:
+            anonymizer.pseudonym(mac)
+    secs = time.time() - start
+
+    hashes = sum(len(macs) for macs in macs_per_cycle)
+    if anonymizer.cache is not None:
+        hashes = anonymizer.cache.misses
+    return hashes, secs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--devices', dest='devices', type=int, default=20000)
+    parser.add_argument('--cycles', dest='cycles', type=int, default=12)
+    parser.add_argument('--repeat-rate', dest='repeat_rate', type=float, default=0.8)
+    parser.add_argument('--bcrypt-cost', dest='bcrypt_cost', type=int, default=4)
+    parser.add_argument('--bcrypt-devices', dest='bcrypt_devices', type=int, default=200)
+    args = parser.parse_args()
+
+    import bcrypt
+    macs_per_cycle = cycles(args.devices, args.cycles, args.repeat_rate)
+    total = args.devices * args.cycles
+
+    # bcrypt is too slow to hash every device, so time a sample and scale it up
+    salt = bcrypt.gensalt(args.bcrypt_cost)
+    sample = cycles(args.bcrypt_devices, args.cycles, args.repeat_rate)
+    for cache_size in (0, 65536):
+        hashes, secs = run(MacAnonymizer('bcrypt', salt=salt, cache_size=cache_size), sample)
+        per_hash = secs / hashes
+        hashes = hashes * args.devices / args.bcrypt_devices
+        print 'mode=bcrypt cost=%-2d cache=%-5s hashes=%-8d secs=%-8.1f hours-at-cost-%d=%.3g' % (
+            args.bcrypt_cost, cache_size > 0, hashes, per_hash * hashes, SALT_COST,
+            per_hash * hashes * 2 ** (SALT_COST - args.bcrypt_cost) / 3600)
+
+    for cache_size in (0, 65536):
+        hashes, secs = run(MacAnonymizer('hmac', key='benchmark', cache_size=cache_size), macs_per_cycle)
+        print 'mode=hmac   cache=%-5s hashes=%-8d secs=%-8.3f us-per-mac=%.2f' % (
+            cache_size > 0, hashes, secs, secs * 1e6 / total)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+#
+# Copyright (c) 2018 by Armored Things, Inc.  All rights reserved.
+#
+"""
+Measures the time and the resident memory it takes to look up the vendor of a
+mac address in a fresh process, with the wifi_constants dict literal versus the
+memory mapped OUI index.  Each case runs in its own interpreter, after a warm
+up run so that the .pyc files and the index have already been written.
+
+    python benchmarks/oui_startup.py --repeat 5
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'atwifi')
+
+CASES = [
+    ('interpreter', "pass"),
+    ('dict', "from wifi_constants import manufacturer_oui_prefixes\n"
+             "vendor = manufacturer_oui_prefixes.get('f0:db:e2')"),
+    ('index', "from oui import oui_vendor\n"
+              "vendor = oui_vendor('f0:db:e2:01:02:03')"),
+]
+
+MEASURE = """
+import sys, time, resource
+sys.path.insert(0, %r)
+start = time.time()
+%s
+print time.time() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+"""
+
+
+def measure(code):
+    """ Runs the code in a fresh interpreter and returns (seconds, max rss in kilobytes). """
+
+    output = subprocess.check_output([sys.executable, '-c', MEASURE % (PACKAGE_DIR, code)])
+    secs, rss_kb = output.split()
+    return float(secs), int(rss_kb)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', dest='repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    for name, code in CASES:
+        measure(code)
+        runs = [measure(code) for _ in range(args.repeat)]
+        print 'case=%-12s startup-ms=%-8.2f max-rss-kb=%d' % (name, min(secs for secs, _ in runs) * 1000,
+                                                            min(rss for _, rss in runs))
+
+
+if __name__ == '__main__':
+    main()
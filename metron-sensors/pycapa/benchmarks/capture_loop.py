@@ -0,0 +1,111 @@
+#
+#  Licensed to the Apache Software Foundation (ASF) under one or more
+#  contributor license agreements.  See the NOTICE file distributed with
+#  this work for additional information regarding copyright ownership.
+#  The ASF licenses this file to You under the Apache License, Version 2.0
+#  (the "License"); you may not use this file except in compliance with
+#  the License.  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Measures the packets per second that the producer can sustain when capturing
+one packet at a time versus capturing batches of packets.
+
+Packets are read from a pcap file in place of a live interface and are sent
+to an in-memory stand-in for Kafka, so only the capture path is measured.
+
+    python benchmarks/capture_loop.py --pcap-file capture.pcap --batch-size 1 64 512
+"""
+import argparse
+import os
+import sys
+import time
+import pcapy
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from pycapa import producer
+from pycapa.pycapa_cli import make_parser
+import standin
+
+
+def run(pcap_file, batch_size, options=[]):
+    """ Runs the producer over a pcap file and returns (packets, seconds). """
+
+    args = make_parser().parse_args(['--producer', '--interface', pcap_file, '--kafka-topic', 'pcap',
+                                     '--batch-size', str(batch_size)] + options)
+    args.kafka_configs = {}
+
+    # the producer stops once the pcap file is exhausted
+    def open_offline(interface, snaplen, promisc, timeout_ms):
+        return ExhaustibleReader(pcapy.open_offline(interface))
+
+    producer.pcapy.open_live = open_offline
+    producer.Producer = standin.Producer
+    producer.finished.clear()
+
+    start = time.time()
+    producer.producer(args)
+    return ExhaustibleReader.pkts, time.time() - start
+
+
+class ExhaustibleReader(object):
+    """ Signals the producer to finish once the underlying pcap file has no more packets. """
+
+    pkts = 0
+
+    def __init__(self, reader):
+        self.reader = reader
+        ExhaustibleReader.pkts = 0
+
+    def next(self):
+        (pkt_hdr, pkt_raw) = self.reader.next()
+        if pkt_hdr is None:
+            producer.finished.set()
+        else:
+            ExhaustibleReader.pkts += 1
+        return (pkt_hdr, pkt_raw)
+
+    def setfilter(self, bpf_filter):
+        self.reader.setfilter(bpf_filter)
+
+    def stats(self):
+        # statistics are not available when reading from a pcap file
+        return (ExhaustibleReader.pkts, 0, 0)
+
+    def dispatch(self, max_pkts, callback):
+        pkts = self.reader.dispatch(max_pkts, callback)
+        if pkts <= 0:
+            producer.finished.set()
+        ExhaustibleReader.pkts += max(pkts, 0)
+        return pkts
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pcap-file', dest='pcap_file', required=True)
+    parser.add_argument('--batch-size', dest='batch_sizes', type=int, nargs='+', default=[1, 64, 512])
+    parser.add_argument('--filter', dest='filter')
+    parser.add_argument('--repeat', dest='repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    options = ['--filter', args.filter] if args.filter else []
+
+    for batch_size in args.batch_sizes:
+        # keep the best run, by packets per second, along with its packet count
+        (best_pkts, best) = (0, 0.0)
+        for _ in range(args.repeat):
+            (pkts, secs) = run(args.pcap_file, batch_size, options)
+            if pkts / secs > best:
+                (best_pkts, best) = (pkts, pkts / secs)
+        print 'batch-size=%-6d packets=%-10d pps=%.0f' % (batch_size, best_pkts, best)
+
+
+if __name__ == '__main__':
+    main()
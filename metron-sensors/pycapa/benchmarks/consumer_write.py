@@ -0,0 +1,104 @@
+#
+#  Licensed to the Apache Software Foundation (ASF) under one or more
+#  contributor license agreements.  See the NOTICE file distributed with
+#  this work for additional information regarding copyright ownership.
+#  The ASF licenses this file to You under the Apache License, Version 2.0
+#  (the "License"); you may not use this file except in compliance with
+#  the License.  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Measures the packets per second that the consumer can write as a libpcap
+stream, when packing and flushing each packet as it arrives versus packing
+packets into a reusable buffer that is written out once full.
+
+Packets are generated in memory and, by default, written through a pipe to a
+process that discards them, much as the consumer writes to tshark, so only the
+write path is measured.
+
+    python benchmarks/consumer_write.py --packets 1000000 --packet-size 64 1500
+"""
+import argparse
+import os
+import struct
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from pycapa.common import MICROS
+from pycapa.writer import PcapStream
+
+
+def packet_header(ts, caplen, wirelen, precision=MICROS):
+    """ Returns the packet header used in a libpcap-compliant file, as the consumer once packed it. """
+
+    secs = ts / precision
+    frac = ts % precision
+    return struct.pack('IIII', secs, frac, caplen, wirelen)
+
+
+def write_each(out, packets):
+    """ Writes each packet as the consumer once did; packing a header and flushing for every packet. """
+
+    for (ts, wirelen, pkt_raw) in packets:
+        out.write(packet_header(ts, len(pkt_raw), wirelen))
+        out.write(pkt_raw)
+        out.flush()
+
+
+def write_buffered(out, packets):
+    """ Writes each packet through a reusable buffer that is written out once full. """
+
+    stream = PcapStream(out, MICROS)
+    for (ts, wirelen, pkt_raw) in packets:
+        stream.write(ts, wirelen, pkt_raw)
+    stream.close()
+
+
+def run(write, path, packets):
+    """ Writes the packets to a file or, without one, through a pipe and returns the seconds taken. """
+
+    if path:
+        with open(path, "wb") as out:
+            start = time.time()
+            write(out, packets)
+            return time.time() - start
+
+    with open(os.devnull, "wb") as devnull:
+        sink = subprocess.Popen(["cat"], stdin=subprocess.PIPE, stdout=devnull)
+        start = time.time()
+        write(sink.stdin, packets)
+        secs = time.time() - start
+        sink.stdin.close()
+        sink.wait()
+        return secs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output', dest='output')
+    parser.add_argument('--packets', dest='packets', type=int, default=1000000)
+    parser.add_argument('--packet-size', dest='packet_sizes', type=int, nargs='+', default=[64, 512, 1500])
+    parser.add_argument('--repeat', dest='repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    for packet_size in args.packet_sizes:
+        pkt_raw = 'x' * packet_size
+        packets = [(1500000000000000 + i, packet_size, pkt_raw) for i in xrange(args.packets)]
+
+        for (name, write) in [('each', write_each), ('buffered', write_buffered)]:
+            best = min(run(write, args.output, packets) for _ in range(args.repeat))
+            print 'writer=%-10s packet-size=%-6d packets=%-10d pps=%.0f' % (
+                name, packet_size, args.packets, args.packets / best)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,302 @@
+#
+#  Licensed to the Apache Software Foundation (ASF) under one or more
+#  contributor license agreements.  See the NOTICE file distributed with
+#  this work for additional information regarding copyright ownership.
+#  The ASF licenses this file to You under the Apache License, Version 2.0
+#  (the "License"); you may not use this file except in compliance with
+#  the License.  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Measures the producer and the consumer end to end, across snaplens, batch
+sizes and bundle sizes.  The producer replays synthetic or recorded pcap files
+into an in-memory stand-in for Kafka, then the consumer reads the delivered
+messages back out and writes them to /dev/null.
+
+For each run, reports the packets per second, megabytes of messages per
+second, CPU microseconds per packet and, for the producer, the p99 latency
+from producing each message to its delivery being reported, by the stand-in
+or, with a broker, by the Kafka client.
+
+    python benchmarks/pipeline.py --packets 200000 --snaplen 96 65535 --batch-size 1 64 --bundle-size 0 65536
+
+The stand-in ignores the settings of the Kafka client, so to compare producer
+profiles, send to a real broker with '--kafka-broker'.  Only the producer is
+then measured.
+
+    python benchmarks/pipeline.py --kafka-broker localhost:9092 --profile none throughput latency durable
+
+Results can be saved with '--save' and compared against a later run with
+'--baseline'; a run whose packets per second fall by more than '--tolerance'
+percent is reported as a regression and the benchmark exits non-zero.
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import resource
+import shutil
+import struct
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from pycapa import producer, consumer
+from pycapa.pycapa_cli import make_parser, clean_kafka_configs
+from pycapa.stats import percentile
+import standin
+
+# the 'magic', 'version_major', 'version_minor', 'thiszone', 'sigfigs', 'snaplen' and 'network' fields
+GLOBAL_HEADER = struct.Struct("IHHiIII")
+
+# the 'ts_sec', 'ts_usec', 'incl_len' and 'orig_len' fields that precede each packet
+PACKET_HEADER = struct.Struct("IIII")
+
+# the kafka producer, before it is replaced by the stand-in
+KafkaProducer = producer.Producer
+
+
+def synthetic_pcap(path, packets, packet_size, flows=1024):
+    """ Writes a pcap file of UDP packets across a number of flows, one microsecond apart. """
+
+    rand = random.Random(packets)
+    headers = []
+    for _ in range(flows):
+        (src, dst) = (struct.pack("!I", rand.getrandbits(32)), struct.pack("!I", rand.getrandbits(32)))
+        (sport, dport) = (rand.randint(1024, 65535), rand.choice([53, 80, 443, 8080]))
+        ip = struct.pack("!BBHHHBBH4s4s", 0x45, 0, packet_size - 14, 0, 0, 64, 17, 0, src, dst)
+        udp = struct.pack("!HHHH", sport, dport, packet_size - 34, 0)
+        headers.append("\x00\x01\x02\x03\x04\x05\x00\x06\x07\x08\x09\x0a\x08\x00" + ip + udp)
+
+    payload = "x" * max(packet_size - 42, 0)
+    with open(path, "wb") as f:
+        f.write(GLOBAL_HEADER.pack(0xa1b2c3d4, 2, 4, 0, 0, 65535, 1))
+        for i in xrange(packets):
+            pkt = (headers[i % flows] + payload)[:packet_size]
+            f.write(PACKET_HEADER.pack(1500000000 + i / 1000000, i % 1000000, len(pkt), len(pkt)))
+            f.write(pkt)
+
+
+def cpu_secs():
+    """ Returns the user and system CPU seconds used by this process. """
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def measure(run):
+    """ Runs a function that returns (packets, bytes) and returns (packets, bytes, secs, cpu_secs). """
+
+    (start, start_cpu) = (time.time(), cpu_secs())
+    (pkts, nbytes) = run()
+    return (pkts, nbytes, time.time() - start, cpu_secs() - start_cpu)
+
+
+class CountingProducer(object):
+    """ Counts the bytes sent through a Kafka producer and records the latency of each delivery. """
+
+    # the most recently created producer
+    last = None
+
+    def __init__(self, configs):
+        self.producer = KafkaProducer(configs)
+        self.bytes_out = 0
+        self.latencies = []
+        self.callbacks = {}
+        CountingProducer.last = self
+
+    def __len__(self):
+        return len(self.producer)
+
+    def __getattr__(self, name):
+        return getattr(self.producer, name)
+
+    def delivered(self, callback):
+        """ Returns a delivery callback that records the latency reported by the Kafka client, then calls another. """
+
+        def on_delivery(err, msg):
+            if err is None and msg.latency() is not None:
+                self.latencies.append(msg.latency())
+            callback(err, msg)
+
+        return on_delivery
+
+    def produce(self, topic, value=None, key=None, callback=None, **kwargs):
+        self.bytes_out += len(value)
+
+        # the producer passes the same callback with every message, so wrap it only once
+        if callback is not None:
+            wrapped = self.callbacks.get(callback)
+            if wrapped is None:
+                wrapped = self.callbacks[callback] = self.delivered(callback)
+            kwargs["callback"] = wrapped
+        return self.producer.produce(topic, value, key, **kwargs)
+
+
+def run_producer(pcap_files, snaplen, batch_size, bundle_size, profile, kafka_broker, kafka_topic):
+    """ Replays pcap files into the stand-in for Kafka, or a broker, and returns (packets, bytes). """
+
+    argv = ['--producer', '--kafka-topic', kafka_topic, '--snaplen', str(snaplen), '--batch-size', str(batch_size),
+            '--bundle-size', str(bundle_size), '--profile', profile]
+    if kafka_broker:
+        # the producer only asks for failed deliveries to be reported, unless told otherwise, which would
+        # leave no latencies to record
+        argv += ['--kafka-broker', kafka_broker, '-X', 'delivery.report.only.error=false']
+    for path in pcap_files:
+        argv += ['--pcap-file', path]
+    args = make_parser().parse_args(argv)
+    clean_kafka_configs(args)
+
+    producer.Producer = CountingProducer if kafka_broker else standin.Producer
+    standin.Producer.keep_messages = True
+    producer.finished.clear()
+
+    (pkts_in, pkts_out) = producer.producer(args)
+    return (pkts_out, producer.Producer.last.bytes_out)
+
+
+def run_consumer(messages, pkts, batch_size):
+    """ Consumes messages from the stand-in for Kafka, writes them to /dev/null and returns (packets, bytes). """
+
+    args = make_parser().parse_args(['--consumer', '--kafka-topic', 'pcap', '--kafka-offset', 'begin',
+                                     '--batch-size', str(batch_size), '--max-packets', str(pkts)])
+    args.kafka_configs = {}
+
+    consumer.Consumer = standin.Consumer
+    standin.Consumer.messages = messages
+    consumer.finished.clear()
+
+    # the consumer writes to stdout, then closes it
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "wb")
+    try:
+        consumer.consumer(args, poll_timeout=0.1)
+    finally:
+        sys.stdout = stdout
+
+    return (pkts, sum(len(msg.value()) for msg in messages))
+
+
+def result(phase, snaplen, batch_size, bundle_size, profile, pkts, nbytes, secs, cpu, latencies=None):
+    """ Returns the metrics of a single run. """
+
+    p99_ms = percentile(sorted(latencies), 99) * 1000 if latencies else None
+    return {
+        "phase": phase,
+        "snaplen": snaplen,
+        "batch_size": batch_size,
+        "bundle_size": bundle_size,
+        "profile": profile,
+        "packets": pkts,
+        "pps": pkts / secs,
+        "mb_per_sec": nbytes / secs / (1 << 20),
+        "cpu_us_per_packet": cpu * 1e6 / max(pkts, 1),
+        "p99_latency_ms": p99_ms
+    }
+
+
+def key(r):
+    return "%s/%d/%d/%d/%s" % (r["phase"], r["snaplen"], r["batch_size"], r["bundle_size"], r.get("profile", "none"))
+
+
+def report(r):
+    p99 = "%.3f" % r["p99_latency_ms"] if r["p99_latency_ms"] is not None else "-"
+    print '%-8s snaplen=%-6d batch-size=%-5d bundle-size=%-7d profile=%-10s packets=%-9d pps=%-9.0f ' \
+          'MB/s=%-7.1f cpu-us/pkt=%-6.2f p99-ms=%s' % (r["phase"], r["snaplen"], r["batch_size"], r["bundle_size"],
+                                                      r["profile"], r["packets"], r["pps"], r["mb_per_sec"],
+                                                      r["cpu_us_per_packet"], p99)
+
+
+def compare(results, baseline, tolerance):
+    """ Returns the runs whose packets per second fell by more than the tolerance, as a percentage. """
+
+    regressions = []
+    for r in results:
+        before = baseline.get(key(r))
+        if before is not None and r["pps"] < before["pps"] * (1 - tolerance / 100.0):
+            regressions.append((r, before))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pcap-file', dest='pcap_files', action='append')
+    parser.add_argument('--packets', dest='packets', type=int, default=200000)
+    parser.add_argument('--packet-size', dest='packet_size', type=int, default=512)
+    parser.add_argument('--snaplen', dest='snaplens', type=int, nargs='+', default=[65535])
+    parser.add_argument('--batch-size', dest='batch_sizes', type=int, nargs='+', default=[1, 64])
+    parser.add_argument('--bundle-size', dest='bundle_sizes', type=int, nargs='+', default=[0, 65536])
+    parser.add_argument('--profile', dest='profiles', nargs='+', default=['none'])
+    parser.add_argument('--kafka-broker', dest='kafka_broker')
+    parser.add_argument('--kafka-topic', dest='kafka_topic', default='pcap')
+    parser.add_argument('--repeat', dest='repeat', type=int, default=3)
+    parser.add_argument('--save', dest='save')
+    parser.add_argument('--baseline', dest='baseline')
+    parser.add_argument('--tolerance', dest='tolerance', type=float, default=10.0)
+    args = parser.parse_args()
+
+    # without a recorded pcap, replay a synthetic one
+    tmp_dir = None
+    pcap_files = args.pcap_files
+    if not pcap_files:
+        tmp_dir = tempfile.mkdtemp(prefix="pycapa-bench-")
+        pcap_files = [os.path.join(tmp_dir, "synthetic.pcap")]
+        synthetic_pcap(pcap_files[0], args.packets, args.packet_size)
+
+    # with a broker, only the producer is measured
+    phases = ("producer",) if args.kafka_broker else ("producer", "consumer")
+
+    results = []
+    try:
+        runs = itertools.product(args.snaplens, args.batch_sizes, args.bundle_sizes, args.profiles)
+        for (snaplen, batch_size, bundle_size, profile) in runs:
+
+            # keep the best of each phase, by packets per second
+            best = {}
+            for _ in range(args.repeat):
+                (pkts, nbytes, secs, cpu) = measure(lambda: run_producer(
+                    pcap_files, snaplen, batch_size, bundle_size, profile, args.kafka_broker, args.kafka_topic))
+                delivered = producer.Producer.last
+                r = result("producer", snaplen, batch_size, bundle_size, profile, pkts, nbytes, secs, cpu,
+                           delivered.latencies)
+                if r["pps"] > best.get("producer", {"pps": 0})["pps"]:
+                    best["producer"] = r
+
+                if "consumer" in phases:
+                    (pkts, nbytes, secs, cpu) = measure(lambda: run_consumer(delivered.messages, pkts, batch_size))
+                    r = result("consumer", snaplen, batch_size, bundle_size, profile, pkts, nbytes, secs, cpu)
+                    if r["pps"] > best.get("consumer", {"pps": 0})["pps"]:
+                        best["consumer"] = r
+
+            for phase in phases:
+                report(best[phase])
+                results.append(best[phase])
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = dict((key(r), r) for r in json.load(f))
+        regressions = compare(results, baseline, args.tolerance)
+        for (r, before) in regressions:
+            print 'regression: %s pps=%.0f baseline=%.0f' % (key(r), r["pps"], before["pps"])
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+#
+#  Licensed to the Apache Software Foundation (ASF) under one or more
+#  contributor license agreements.  See the NOTICE file distributed with
+#  this work for additional information regarding copyright ownership.
+#  The ASF licenses this file to You under the Apache License, Version 2.0
+#  (the "License"); you may not use this file except in compliance with
+#  the License.  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import time
+import random
+
+# the type of timestamp set by the producer when a message is created
+TIMESTAMP_CREATE_TIME = 1
+
+
+class Message(object):
+    """ A delivered message, as seen by a delivery callback. """
+
+    def __init__(self, topic, partition, offset, key, value, created=None, timestamp=0):
+        self._topic = topic
+        self._partition = partition
+        self._offset = offset
+        self._key = key
+        self._value = value
+        self._created = created or time.time()
+        self._timestamp = (TIMESTAMP_CREATE_TIME, timestamp or int(self._created * 1000))
+
+    def topic(self):
+        return self._topic
+
+    def partition(self):
+        return self._partition
+
+    def offset(self):
+        return self._offset
+
+    def key(self):
+        return self._key
+
+    def value(self):
+        return self._value
+
+    def timestamp(self):
+        return self._timestamp
+
+    def latency(self):
+        return time.time() - self._created
+
+    def error(self):
+        return None
+
+
+class TopicMetadata(object):
+    """ The metadata of a topic, as returned by 'list_topics'. """
+
+    def __init__(self, topic, partitions):
+        self.topic = topic
+        self.partitions = dict((p, None) for p in range(partitions))
+
+
+class ClusterMetadata(object):
+    """ The metadata of a cluster containing a single topic. """
+
+    def __init__(self, topic, partitions):
+        self.topics = {topic: TopicMetadata(topic, partitions)}
+
+
+class Producer(object):
+    """
+    An in-memory stand-in for a Kafka producer that acknowledges every message on 'poll'.  The latency
+    of each delivery, from 'produce' to 'poll', is recorded and, if asked, each delivered message is
+    kept so that it can be consumed again.
+    """
+
+    # the number of partitions in every topic
+    partitions = 1
+
+    # keep each delivered message
+    keep_messages = False
+
+    # the most recently created producer
+    last = None
+
+    def __init__(self, configs):
+        self.configs = configs
+        self.only_errors = str(configs.get("delivery.report.only.error")).lower() == "true"
+        self.queue = []
+        self.offset = 0
+        self.bytes_out = 0
+        self.latencies = []
+        self.messages = []
+        Producer.last = self
+
+    def __len__(self):
+        return len(self.queue)
+
+    def list_topics(self, topic=None, timeout=-1):
+        return ClusterMetadata(topic, Producer.partitions)
+
+    def produce(self, topic, value=None, key=None, partition=-1, callback=None, on_delivery=None, timestamp=0):
+        # like the kafka client, accept only a string or a read-only buffer, then take a copy of the key and value
+        for arg in (key, value):
+            if arg is not None and not isinstance(arg, (str, buffer)):
+                raise TypeError("expected a string or read-only buffer, not %s" % type(arg).__name__)
+        callback = callback or on_delivery
+        partition = partition if partition >= 0 else random.randint(0, Producer.partitions - 1)
+        self.queue.append((topic, partition, bytes(key), bytes(value), callback, time.time(), timestamp))
+
+    def poll(self, timeout=0):
+        delivered = len(self.queue)
+        now = time.time()
+        for (topic, partition, key, value, callback, created, timestamp) in self.queue:
+            self.offset += 1
+            self.bytes_out += len(value)
+            self.latencies.append(now - created)
+            if callback is not None and not self.only_errors:
+                callback(None, Message(topic, partition, self.offset, key, value, created, timestamp))
+            if Producer.keep_messages:
+                self.messages.append(Message(topic, partition, self.offset, key, value, created, timestamp))
+        self.queue = []
+        return delivered
+
+    def flush(self, timeout=None):
+        self.poll()
+        return 0
+
+
+class TopicPartition(object):
+    """ A partition of a topic and the offset to consume it from. """
+
+    def __init__(self, topic, partition=-1, offset=-1001):
+        self.topic = topic
+        self.partition = partition
+        self.offset = offset
+
+
+class Consumer(object):
+    """ An in-memory stand-in for a Kafka consumer that returns the messages given to it, in order. """
+
+    # the messages of every topic, in the order consumed
+    messages = []
+
+    def __init__(self, configs):
+        self.configs = configs
+        self.position = 0
+
+    def subscribe(self, topics, on_assign=None):
+        partitions = sorted(set(msg.partition() for msg in Consumer.messages))
+        if on_assign is not None:
+            on_assign(self, [TopicPartition(topics[0], p) for p in partitions])
+
+    def assign(self, partitions):
+        pass
+
+    def consume(self, num_messages=1, timeout=-1):
+        if self.position >= len(Consumer.messages):
+            # like a consumer at the end of its partitions, wait for more messages
+            time.sleep(max(timeout, 0))
+            return []
+
+        msgs = Consumer.messages[self.position:self.position + num_messages]
+        self.position += len(msgs)
+        return msgs
+
+    def close(self):
+        pass
@@ -0,0 +1,139 @@
+#
+#  Licensed to the Apache Software Foundation (ASF) under one or more
+#  contributor license agreements.  See the NOTICE file distributed with
+#  this work for additional information regarding copyright ownership.
+#  The ASF licenses this file to You under the Apache License, Version 2.0
+#  (the "License"); you may not use this file except in compliance with
+#  the License.  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import struct
+import time
+from common import MILLIS, MICROS, NANOS, KEY_VERSION_NANOS, convert_ts, key_precision, unpack_ts
+
+# the key of a bundle holds the timestamp of its first packet and the number of packets; like the key of
+# a single packet, a versioned key begins with a version byte
+BUNDLE_KEY = struct.Struct(">QI")
+VERSIONED_BUNDLE_KEY = struct.Struct(">BQI")
+
+# each packet in a bundle is preceded by its timestamp, captured length and original length
+RECORD_HEADER = struct.Struct(">QII")
+
+
+def is_bundle(key):
+    """ Returns true if the message key identifies a bundle of packets. """
+
+    return key is not None and len(key) in (BUNDLE_KEY.size, VERSIONED_BUNDLE_KEY.size)
+
+
+def unpack_key(key):
+    """ Returns the timestamp, timestamp precision and number of packets of a message key. """
+
+    key = bytes(key)
+    if len(key) == BUNDLE_KEY.size:
+        (ts, count) = BUNDLE_KEY.unpack(key)
+        return (ts, MICROS, count)
+
+    elif len(key) == VERSIONED_BUNDLE_KEY.size:
+        (version, ts, count) = VERSIONED_BUNDLE_KEY.unpack(key)
+        return (ts, key_precision(version), count)
+
+    (ts, precision) = unpack_ts(key)
+    return (ts, precision, 1)
+
+
+def packet_count(key):
+    """ Returns the number of packets contained in a message. """
+
+    if is_bundle(key):
+        return unpack_key(key)[2]
+    return 1
+
+
+def record_timestamp(key):
+    """ Returns the capture time of the first packet in a message, in epoch milliseconds, as its record timestamp. """
+
+    (ts, precision, _) = unpack_key(key)
+    return convert_ts(ts, precision, MILLIS)
+
+
+def unbundle(key, value, precision=MICROS):
+    """ Returns the (timestamp, original length, packet) of each packet contained in a message. """
+
+    (ts, key_ts_precision, count) = unpack_key(key)
+    if not is_bundle(key):
+        return [(convert_ts(ts, key_ts_precision, precision), len(value), value)]
+
+    packets = []
+    offset = 0
+    while offset < len(value):
+        (ts, caplen, wirelen) = RECORD_HEADER.unpack_from(value, offset)
+        offset += RECORD_HEADER.size
+        packets.append((convert_ts(ts, key_ts_precision, precision), wirelen, value[offset:offset + caplen]))
+        offset += caplen
+
+    return packets
+
+
+class Bundle(object):
+    """ Packs multiple packets into a single Kafka message. """
+
+    def __init__(self, max_bytes, max_ms, precision=MICROS):
+        self.max_bytes = max_bytes
+        self.max_secs = max_ms / 1000.0
+        self.precision = precision
+        self.clear()
+
+    def __len__(self):
+        return self.count
+
+    def clear(self):
+        """ Removes all packets from the bundle. """
+
+        self.value = bytearray()
+        self.count = 0
+        self.first_ts = 0
+        self.started = None
+
+    def append(self, ts, wirelen, pkt_raw):
+        """ Adds a packet to the bundle. """
+
+        if self.count == 0:
+            self.first_ts = ts
+            self.started = time.time()
+
+        # copies the packet, which may be a buffer that is only valid until the next capture
+        self.value += RECORD_HEADER.pack(ts, len(pkt_raw), wirelen)
+        self.value += pkt_raw
+        self.count += 1
+
+    def is_full(self):
+        """ Returns true if the bundle has reached its maximum size. """
+
+        return len(self.value) >= self.max_bytes
+
+    def is_ready(self, now=None):
+        """ Returns true if the bundle has reached its maximum size or age. """
+
+        if self.count == 0:
+            return False
+        return self.is_full() or (now or time.time()) - self.started >= self.max_secs
+
+    def pop(self):
+        """ Returns the key and value of a message containing all packets in the bundle, then clears the bundle. """
+
+        if self.precision == NANOS:
+            key = VERSIONED_BUNDLE_KEY.pack(KEY_VERSION_NANOS, self.first_ts, self.count)
+        else:
+            key = BUNDLE_KEY.pack(self.first_ts, self.count)
+        # the kafka client only accepts a string or a read-only buffer, not a bytearray
+        value = bytes(self.value)
+        self.clear()
+        return (key, value)
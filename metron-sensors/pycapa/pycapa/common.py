@@ -18,23 +18,66 @@ from datetime import datetime
 import struct
 
 
+# the precision of a timestamp; the number of ticks per second
+MILLIS = 1000
+MICROS = 1000000
+NANOS = 1000000000
+TS_PRECISIONS = {
+    "micro": MICROS,
+    "nano": NANOS
+}
+
+# the original key holds only a timestamp in epoch microseconds.  a versioned key begins with a version
+# byte, so it is one byte longer than the original key and can be told apart from it
+TS_KEY = struct.Struct(">Q")
+VERSIONED_TS_KEY = struct.Struct(">BQ")
+
+# a version 1 key holds a timestamp in epoch nanoseconds.  metron's pcap topology folds every byte of the key
+# into a long, which drops the version byte, so it reads these keys only if its timestamp granularity is
+# changed to nanoseconds; otherwise their timestamps are taken to be 1000 times later than they are
+KEY_VERSION_NANOS = 1
+
+
 def to_hex(s):
     """ Transforms a string to hexadecimal notation. """
     hex_str = ' '.join("{0:02x}".format(ord(c)) for c in s)
     return '\n'.join([hex_str[i:i+48] for i in range(0, len(hex_str), 48)])
 
 
-def to_date(epoch_micros):
-    """ Transforms a timestamp in epoch microseconds to a more legible format. """
-    epoch_secs = epoch_micros / 1000000.0
+def to_date(ts, precision=MICROS):
+    """ Transforms an epoch timestamp of the given precision to a more legible format. """
+    epoch_secs = ts / float(precision)
     return datetime.fromtimestamp(epoch_secs).strftime('%Y-%m-%d %H:%M:%S.%f')
 
 
-def pack_ts(ts):
-    """ Packs a timestamp into a binary form. """
-    return struct.pack(">Q", ts)
+def convert_ts(ts, from_precision, to_precision):
+    """ Converts an integer timestamp from one precision to another, without float math. """
+    if from_precision == to_precision:
+        return ts
+    elif from_precision > to_precision:
+        return ts / (from_precision / to_precision)
+    else:
+        return ts * (to_precision / from_precision)
+
+
+def key_precision(version):
+    """ Returns the timestamp precision of a versioned key. """
+    if version != KEY_VERSION_NANOS:
+        raise ValueError("unsupported key version: %d" % version)
+    return NANOS
+
+
+def pack_ts(ts, precision=MICROS):
+    """ Packs a timestamp into a binary form; only a nanosecond timestamp needs a versioned key. """
+    if precision == NANOS:
+        return VERSIONED_TS_KEY.pack(KEY_VERSION_NANOS, ts)
+    return TS_KEY.pack(ts)
 
 
 def unpack_ts(packed_ts):
-    """ Unpacks a timestamp from a binary form. """
-    return struct.unpack_from(">Q", bytes(packed_ts), 0)[0]
+    """ Unpacks a timestamp and its precision from a binary form. """
+    packed_ts = bytes(packed_ts)
+    if len(packed_ts) == VERSIONED_TS_KEY.size:
+        (version, ts) = VERSIONED_TS_KEY.unpack(packed_ts)
+        return (ts, key_precision(version))
+    return (TS_KEY.unpack_from(packed_ts, 0)[0], MICROS)
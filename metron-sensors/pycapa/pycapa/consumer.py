@@ -23,12 +23,31 @@ import random
 import logging
 import time
 import struct
-from confluent_kafka import Consumer, KafkaException, KafkaError, OFFSET_BEGINNING, OFFSET_END, OFFSET_STORED
-from common import to_date, to_hex, unpack_ts
+import socket
+from confluent_kafka import Consumer, KafkaException, KafkaError, OFFSET_BEGINNING, OFFSET_END, OFFSET_STORED, \
+    TIMESTAMP_NOT_AVAILABLE, TopicPartition
+from common import to_date, to_hex, MICROS, NANOS, TS_PRECISIONS
+from bundle import unbundle
+from writer import PcapStream, RotatingPcapWriter, FilteredWriter, TeeWriter
+from ring import PCAP_NETMASK_UNKNOWN
+from merge import PartitionReader, partitions, merge
+from indexer import PacketIndex
 
 
 finished = threading.Event()
 
+# the record timestamp of a message is the capture time of its first packet, but messages are not strictly
+# in capture order; a bundle holds packets captured after its first and workers send to partitions
+# concurrently.  so a partition is read from this allowance before the start time, and is only known to
+# have passed the end time once its record timestamps have passed it by this allowance
+LATE_DELIVERY_MS = 5000
+
+# the magic number of a libpcap-compliant file identifies the precision of its timestamps
+PCAP_MAGIC = {
+    MICROS: 0xa1b2c3d4L,
+    NANOS: 0xa1b23c4dL
+}
+
 
 def signal_handler(signum, frame):
     """ Initiates a clean shutdown for a SIGINT """
@@ -45,17 +64,6 @@ def global_header(args, magic=0xa1b2c3d4L, version_major=2, version_minor=4, zon
         sigfigs, args.snaplen, network)
 
 
-def packet_header(msg):
-    """ Returns the packet header used in a libpcap-compliant file. """
-
-    epoch_micros = struct.unpack_from(">Q", bytes(msg.key()), 0)[0]
-    secs = epoch_micros / 1000000
-    usec = epoch_micros % 1000000
-    caplen = wirelen = len(msg.value())
-    hdr = struct.pack('IIII', secs, usec, caplen, wirelen)
-    return hdr
-
-
 def seek_to_end(consumer, partitions):
     """ Advance all partitions to the last offset. """
 
@@ -83,6 +91,304 @@ def seek_to_stored(consumer, partitions):
     consumer.assign(partitions)
 
 
+class TimeWindow(object):
+    """
+    Consumes only the packets captured within a window of time.  Each partition starts from the first
+    offset whose record timestamp, the capture time, is at or after the start time, less an allowance,
+    as found by 'offsets_for_times', and is paused once its record timestamps pass the end time.  Packets outside
+    the window are skipped.
+    """
+
+    def __init__(self, topic, start_secs, end_secs, precision, seek):
+        self.topic = topic
+        self.start_ms = int(start_secs * 1000) if start_secs is not None else None
+        self.end_ms = int(end_secs * 1000) if end_secs is not None else None
+        self.start_ts = int(start_secs * precision) if start_secs is not None else 0
+        self.end_ts = int(end_secs * precision) if end_secs is not None else None
+        self.seek = seek
+        self.assigned = set()
+        self.done = set()
+        self.at_end = set()
+
+    def on_assign(self, consumer, partitions):
+        """ Advance all partitions to the first offset at or after the start time. """
+
+        self.assigned = set(p.partition for p in partitions)
+        if self.start_ms is None:
+            return self.seek(consumer, partitions)
+
+        for p in partitions:
+            p.offset = max(self.start_ms - LATE_DELIVERY_MS, 0)
+        partitions = consumer.offsets_for_times(partitions, timeout=10.0)
+
+        # a partition without any record at or after the start time has nothing to consume
+        for p in partitions:
+            logging.info("Seeking to start time; partition=%d, offset=%d", p.partition, p.offset)
+            if p.offset < 0:
+                p.offset = OFFSET_END
+                if self.end_ms is not None:
+                    self.done.add(p.partition)
+        consumer.assign(partitions)
+
+    def contains(self, ts):
+        """ Returns true if a packet was captured within the window. """
+
+        return ts >= self.start_ts and (self.end_ts is None or ts <= self.end_ts)
+
+    def is_past_end(self, consumer, msg):
+        """ Returns true if a message is from a partition that has passed the end time, pausing the partition. """
+
+        if self.end_ms is None:
+            return False
+        elif msg.partition() in self.done:
+            return True
+
+        self.at_end.discard(msg.partition())
+
+        (ts_type, ts_ms) = msg.timestamp()
+        if ts_type != TIMESTAMP_NOT_AVAILABLE and ts_ms > self.end_ms + LATE_DELIVERY_MS:
+            self.finish(consumer, msg.partition())
+            return True
+        return False
+
+    def on_eof(self, consumer, partition):
+        """ A partition that reaches its end after the end time has nothing more to consume. """
+
+        if self.end_ms is not None:
+            self.at_end.add(partition)
+            self.finish_at_end(consumer)
+
+    def finish_at_end(self, consumer):
+        """
+        Pauses the partitions that are still at their end once the end time has passed.  The end of a
+        partition is only reported once, so a partition that reached it before then is checked again here.
+        """
+
+        if self.at_end and time.time() * 1000 > self.end_ms + LATE_DELIVERY_MS:
+            for partition in sorted(self.at_end):
+                self.finish(consumer, partition)
+            self.at_end.clear()
+
+    def finish(self, consumer, partition):
+        """ Pauses a partition that has passed the end time. """
+
+        if partition not in self.done:
+            logging.info("Reached end time; partition=%d", partition)
+            self.done.add(partition)
+            consumer.pause([TopicPartition(self.topic, partition)])
+
+    def is_finished(self):
+        """ Returns true once every partition has passed the end time. """
+
+        return self.end_ms is not None and len(self.assigned) > 0 and self.done >= self.assigned
+
+
+def time_window(args, precision, seek):
+    """ Returns the window of time to consume packets from, if any. """
+
+    if args.start_time is None and args.end_time is None:
+        return None
+    return TimeWindow(args.kafka_topic, args.start_time, args.end_time, precision, seek)
+
+
+def compile_filter(args, bpf_filter):
+    """ Compiles a BPF filter expression that packets are matched against before they are written. """
+
+    return pcapy.compile(pcapy.DLT_EN10MB, args.snaplen, bpf_filter, 1, PCAP_NETMASK_UNKNOWN)
+
+
+def open_writer(args, precision):
+    """
+    Returns the writer of packets to rotated pcap files, to an extraction file for each filter or, if
+    'pretty-print' not set, to stdout.  Either way, packets are buffered and written out once the buffer
+    fills or the oldest packet has waited long enough.
+    """
+
+    writers = []
+    if args.output_dir:
+        logging.info("Writing pcap files; dir=%s, max_mb=%d, max_secs=%d, compress=%s", args.output_dir,
+                     args.output_size, args.output_interval, args.compress)
+        writers.append(RotatingPcapWriter(args.output_dir, global_header(args, magic=PCAP_MAGIC[precision]),
+                                          precision, args.output_size << 20, args.output_interval, args.compress,
+                                          buffer_size=args.flush_size << 10, max_ms=args.flush_interval))
+
+    # each extraction writes only the packets that match its own filter to its own file
+    for (path, bpf_filter) in args.extracts or []:
+        logging.info("Writing extraction; path=%s, filter='%s'", path, bpf_filter)
+        extract = open(path, "wb", 0)
+        extract.write(global_header(args, magic=PCAP_MAGIC[precision]))
+        writers.append(FilteredWriter(compile_filter(args, bpf_filter), PcapStream(
+            extract, precision, args.flush_size << 10, args.flush_interval, close_stream=True)))
+
+    if not writers and args.pretty_print == 0:
+        sys.stdout.write(global_header(args, magic=PCAP_MAGIC[precision]))
+        sys.stdout.flush()
+        writers.append(PcapStream(sys.stdout, precision, args.flush_size << 10, args.flush_interval))
+
+    if len(writers) > 1:
+        return TeeWriter(writers)
+    return writers[0] if writers else None
+
+
+def merged_consumer(args, seek, precision, poll_timeout):
+    """ Consumes packets from all partitions of a Kafka topic in parallel and writes them in time order. """
+
+    # each partition is read by its own consumer, which stops at the end of the partition or time window
+    readers = []
+    for partition in partitions(args.kafka_configs, args.kafka_topic):
+        window = time_window(args, precision, seek)
+        reader_seek = window.on_assign if window is not None else seek
+        readers.append(PartitionReader(args.kafka_configs, args.kafka_topic, partition, reader_seek, window,
+                                       precision, args.batch_size, poll_timeout))
+    logging.info("Merging packets from '%d' partition(s) in time order", len(readers))
+
+    writer = open_writer(args, precision)
+
+    # optionally, write only the packets that match a filter
+    program = None
+    if args.filter:
+        logging.info("Applying packet filter; filter='%s'", args.filter)
+        program = compile_filter(args, args.filter)
+
+    for reader in readers:
+        reader.start()
+
+    try:
+        pkts_in = 0
+        for (ts, partition, wirelen, pkt_raw) in merge(readers, finished):
+            if finished.is_set() or (args.max_packets > 0 and pkts_in >= args.max_packets):
+                break
+
+            # rotate the output file and write out buffered packets when due, as packets arrive
+            if writer is not None:
+                writer.flush_if_due()
+
+            if program is not None and not program.filter(pkt_raw):
+                continue
+
+            pkts_in += 1
+
+            if writer is not None:
+
+                # write the packet header and packet
+                writer.write(ts, wirelen, pkt_raw)
+
+            if args.pretty_print > 0 and pkts_in % args.pretty_print == 0:
+
+                # pretty print
+                print 'Packet[%s]: date=%s topic=%s partition=%s len=%s' % (
+                    pkts_in, to_date(ts, precision), args.kafka_topic, partition, len(pkt_raw))
+
+    finally:
+        for reader in readers:
+            reader.stop()
+        if writer is not None:
+            writer.close()
+        sys.stdout.close()
+
+
+def host_address(host):
+    """ Returns the packed form of an IPv4 or IPv6 address, as held by the index. """
+
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    return socket.inet_pton(family, host)
+
+
+def indexed_consumer(args, precision, poll_timeout):
+    """
+    Consumes only the messages that the index shows may hold packets captured within the time window
+    and, if a host is given, to or from that host.  Each range of offsets is read in turn, rather than
+    reading the whole topic.
+    """
+
+    index = PacketIndex(args.index)
+    address = host_address(args.host) if args.host else None
+    ranges = index.ranges(args.start_time, args.end_time, address)
+    index.close()
+    logging.info("Reading '%d' range(s) of offsets from the index; path=%s", len(ranges), args.index)
+
+    # a message may bundle packets of many hosts and times, so each packet must still be checked
+    window = time_window(args, precision, None)
+    bpf_filter = args.filter
+    if args.host:
+        bpf_filter = "(%s) and host %s" % (bpf_filter, args.host) if bpf_filter else "host %s" % args.host
+
+    program = None
+    if bpf_filter:
+        logging.info("Applying packet filter; filter='%s'", bpf_filter)
+        program = compile_filter(args, bpf_filter)
+
+    # the end of a partition marks the end of a range that has not been filled yet
+    kafka_configs = dict(args.kafka_configs)
+    kafka_configs["enable.partition.eof"] = True
+
+    # connect to kafka
+    logging.debug("Connecting to Kafka; %s", kafka_configs)
+    kafka_consumer = Consumer(kafka_configs)
+
+    writer = open_writer(args, precision)
+
+    try:
+        pkts_in = 0
+        for (partition, first, last) in ranges:
+            kafka_consumer.assign([TopicPartition(args.kafka_topic, partition, first)])
+            logging.debug("Reading range; partition=%d, first=%d, last=%d", partition, first, last)
+
+            done = False
+            while not done and not finished.is_set() and (args.max_packets <= 0 or pkts_in < args.max_packets):
+
+                msgs = kafka_consumer.consume(num_messages=min(args.batch_size, last - first + 1),
+                                              timeout=poll_timeout)
+                if writer is not None:
+                    writer.flush_if_due()
+
+                for msg in msgs:
+                    if msg.error():
+                        if msg.error().code() != KafkaError._PARTITION_EOF:
+                            raise KafkaException(msg.error())
+                        done = True
+                        break
+
+                    elif msg.offset() > last:
+                        done = True
+                        break
+
+                    # a message contains either a single packet or a bundle of packets
+                    for (ts, wirelen, pkt_raw) in unbundle(msg.key(), msg.value(), precision):
+                        if args.max_packets > 0 and pkts_in >= args.max_packets:
+                            break
+
+                        elif window is not None and not window.contains(ts):
+                            continue
+
+                        elif program is not None and not program.filter(pkt_raw):
+                            continue
+
+                        pkts_in += 1
+
+                        if writer is not None:
+
+                            # write the packet header and packet
+                            writer.write(ts, wirelen, pkt_raw)
+
+                        if args.pretty_print > 0 and pkts_in % args.pretty_print == 0:
+
+                            # pretty print
+                            print 'Packet[%s]: date=%s topic=%s partition=%s offset=%s len=%s' % (
+                                pkts_in, to_date(ts, precision), args.kafka_topic,
+                                msg.partition(), msg.offset(), len(pkt_raw))
+
+                    if msg.offset() >= last:
+                        done = True
+                        break
+
+    finally:
+        if writer is not None:
+            writer.close()
+        sys.stdout.close()
+        kafka_consumer.close()
+
+
 def consumer(args, poll_timeout=3.0):
     """ Consumes packets from a Kafka topic. """
 
@@ -97,53 +403,109 @@ def consumer(args, poll_timeout=3.0):
     }
     on_assign_cb = kafka_offset_options[args.kafka_offset]
 
+    # the precision of the timestamps written, regardless of the precision of those received
+    precision = TS_PRECISIONS[args.timestamp_precision]
+
+    # optionally, read all partitions in parallel and write packets in time order
+    if args.merge:
+        return merged_consumer(args, on_assign_cb, precision, poll_timeout)
+
+    # optionally, read only the messages that the index points to
+    if args.index:
+        return indexed_consumer(args, precision, poll_timeout)
+
+    # optionally, consume only the packets captured within a window of time
+    kafka_configs = args.kafka_configs
+    window = time_window(args, precision, on_assign_cb)
+    if window is not None:
+        logging.info("Consuming packets within a time window; start=%s, end=%s", args.start_time, args.end_time)
+        on_assign_cb = window.on_assign
+
+        # a partition with no record past the end time is only known to be done once it reaches its end
+        kafka_configs = dict(kafka_configs)
+        kafka_configs["enable.partition.eof"] = True
+
     # connect to kafka
-    logging.debug("Connecting to Kafka; %s", args.kafka_configs)
-    kafka_consumer = Consumer(args.kafka_configs)
+    logging.debug("Connecting to Kafka; %s", kafka_configs)
+    kafka_consumer = Consumer(kafka_configs)
     kafka_consumer.subscribe([args.kafka_topic], on_assign=on_assign_cb)
 
-    # if 'pretty-print' not set, write libpcap global header
-    if args.pretty_print == 0:
-        sys.stdout.write(global_header(args))
-        sys.stdout.flush()
+    writer = open_writer(args, precision)
+
+    # optionally, write only the packets that match a filter
+    program = None
+    if args.filter:
+        logging.info("Applying packet filter; filter='%s'", args.filter)
+        program = compile_filter(args, args.filter)
 
     try:
         pkts_in = 0
         while not finished.is_set() and (args.max_packets <= 0 or pkts_in < args.max_packets):
 
-            # consume a message from kafka
-            msg = kafka_consumer.poll(timeout=poll_timeout)
-            if msg is None:
-                # no message received
-                continue;
+            # stop once every partition has passed the end time
+            if window is not None:
+                window.finish_at_end(kafka_consumer)
+                if window.is_finished():
+                    break
+
+            # consume a batch of messages from kafka; each holds at least one packet, so never consume
+            # more messages than there are packets left to reach 'max-packets'
+            batch_size = args.batch_size
+            if args.max_packets > 0:
+                batch_size = min(batch_size, args.max_packets - pkts_in)
+
+            msgs = kafka_consumer.consume(num_messages=batch_size, timeout=poll_timeout)
+            logging.debug("Batch received: pkts_in=%d, msgs_batch=%d", pkts_in, len(msgs))
+            if writer is not None:
+                writer.flush_if_due()
+
+            for msg in msgs:
+                if args.max_packets > 0 and pkts_in >= args.max_packets:
+                    break
+
+                elif msg.error():
+
+                    if msg.error().code() == KafkaError._PARTITION_EOF:
+                        if window is not None:
+                            window.on_eof(kafka_consumer, msg.partition())
+                        if args.pretty_print > 0:
+                            print "Reached end of topar: topic=%s, partition=%d, offset=%s" % (
+                                msg.topic(), msg.partition(), msg.offset())
+                    else:
+                        raise KafkaException(msg.error())
+
+                    continue
+
+                elif window is not None and window.is_past_end(kafka_consumer, msg):
+                    continue
+
+                # a message contains either a single packet or a bundle of packets
+                for (ts, wirelen, pkt_raw) in unbundle(msg.key(), msg.value(), precision):
+                    if args.max_packets > 0 and pkts_in >= args.max_packets:
+                        break
 
-            elif msg.error():
+                    elif window is not None and not window.contains(ts):
+                        continue
 
-                if msg.error().code() == KafkaError._PARTITION_EOF:
-                    if args.pretty_print > 0:
-                        print "Reached end of topar: topic=%s, partition=%d, offset=%s" % (
-                            msg.topic(), msg.partition(), msg.offset())
-                else:
-                    raise KafkaException(msg.error())
+                    elif program is not None and not program.filter(pkt_raw):
+                        continue
 
-            else:
-                pkts_in += 1
-                logging.debug("Packet received: pkts_in=%d", pkts_in)
+                    pkts_in += 1
 
-                if args.pretty_print == 0:
+                    if writer is not None:
 
-                    # write the packet header and packet
-                    sys.stdout.write(packet_header(msg))
-                    sys.stdout.write(msg.value())
-                    sys.stdout.flush()
+                        # write the packet header and packet
+                        writer.write(ts, wirelen, pkt_raw)
 
-                elif pkts_in % args.pretty_print == 0:
+                    if args.pretty_print > 0 and pkts_in % args.pretty_print == 0:
 
-                    # pretty print
-                    print 'Packet[%s]: date=%s topic=%s partition=%s offset=%s len=%s' % (
-                        pkts_in, to_date(unpack_ts(msg.key())), args.kafka_topic,
-                        msg.partition(), msg.offset(), len(msg.value()))
+                        # pretty print
+                        print 'Packet[%s]: date=%s topic=%s partition=%s offset=%s len=%s' % (
+                            pkts_in, to_date(ts, precision), args.kafka_topic,
+                            msg.partition(), msg.offset(), len(pkt_raw))
 
     finally:
+        if writer is not None:
+            writer.close()
         sys.stdout.close()
         kafka_consumer.close()
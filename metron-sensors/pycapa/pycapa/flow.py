@@ -0,0 +1,101 @@
+#
+#  Licensed to the Apache Software Foundation (ASF) under one or more
+#  contributor license agreements.  See the NOTICE file distributed with
+#  this work for additional information regarding copyright ownership.
+#  The ASF licenses this file to You under the Apache License, Version 2.0
+#  (the "License"); you may not use this file except in compliance with
+#  the License.  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import struct
+import zlib
+
+ETHERTYPE = struct.Struct("!H")
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86dd
+ETHERTYPE_VLAN = (0x8100, 0x88a8)
+
+# the 'version/ihl', 'flags/fragment offset', 'protocol', 'source' and 'destination' fields of an ipv4 header
+IPV4_HEADER = struct.Struct("!B5xHxB2x4s4s")
+IPV4_MORE_FRAGMENTS = 0x2000
+IPV4_FRAGMENT_OFFSET = 0x1fff
+
+# the 'next header', 'source' and 'destination' fields of an ipv6 header
+IPV6_HEADER = struct.Struct("!6xBx16s16s")
+
+# protocols whose header starts with the source and destination ports; tcp, udp and sctp
+PORTS = struct.Struct("!HH")
+PORT_PROTOCOLS = (6, 17, 132)
+
+
+def network_header(pkt):
+    """ Returns the ethertype and offset of the network header, skipping any vlan tags. """
+
+    offset = 12
+    (ethertype,) = ETHERTYPE.unpack_from(pkt, offset)
+    while ethertype in ETHERTYPE_VLAN:
+        offset += 4
+        (ethertype,) = ETHERTYPE.unpack_from(pkt, offset)
+    return (ethertype, offset + ETHERTYPE.size)
+
+
+def ip_addresses(pkt):
+    """ Returns the packed source and destination addresses of the packet, or None if the packet is not IP. """
+
+    try:
+        (ethertype, offset) = network_header(pkt)
+        if ethertype == ETHERTYPE_IPV4:
+            return IPV4_HEADER.unpack_from(pkt, offset)[3:]
+        elif ethertype == ETHERTYPE_IPV6:
+            return IPV6_HEADER.unpack_from(pkt, offset)[1:]
+
+    except struct.error:
+        # the packet was truncated
+        pass
+
+    return None
+
+
+def flow_hash(pkt):
+    """
+    Returns a hash of the packet's protocol, addresses and ports, which is the same for both directions
+    of a flow.  The fields are read at their offsets in the headers, without decoding the packet.  The
+    ports are ignored for fragments, so that all fragments of a packet hash alike.  Returns None if the
+    packet is not IP.
+    """
+
+    try:
+        (ethertype, offset) = network_header(pkt)
+        if ethertype == ETHERTYPE_IPV4:
+            (version_ihl, fragment, proto, src, dst) = IPV4_HEADER.unpack_from(pkt, offset)
+            l4_offset = offset + (version_ihl & 0x0f) * 4
+            has_ports = proto in PORT_PROTOCOLS and not fragment & (IPV4_MORE_FRAGMENTS | IPV4_FRAGMENT_OFFSET)
+
+        elif ethertype == ETHERTYPE_IPV6:
+            (proto, src, dst) = IPV6_HEADER.unpack_from(pkt, offset)
+            l4_offset = offset + IPV6_HEADER.size
+            has_ports = proto in PORT_PROTOCOLS
+
+        else:
+            return None
+
+        src_port = dst_port = 0
+        if has_ports and len(pkt) >= l4_offset + PORTS.size:
+            (src_port, dst_port) = PORTS.unpack_from(pkt, l4_offset)
+
+    except struct.error:
+        # the packet was truncated
+        return None
+
+    # order the endpoints so that both directions of a flow hash alike
+    if (src, src_port) > (dst, dst_port):
+        (src, src_port, dst, dst_port) = (dst, dst_port, src, src_port)
+
+    return zlib.crc32(src + dst + PORTS.pack(src_port, dst_port) + chr(proto)) & 0xffffffff
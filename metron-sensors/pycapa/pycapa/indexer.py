@@ -0,0 +1,243 @@
+#
+#  Licensed to the Apache Software Foundation (ASF) under one or more
+#  contributor license agreements.  See the NOTICE file distributed with
+#  this work for additional information regarding copyright ownership.
+#  The ASF licenses this file to You under the Apache License, Version 2.0
+#  (the "License"); you may not use this file except in compliance with
+#  the License.  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import sqlite3
+import threading
+import signal
+import logging
+import time
+import zlib
+from confluent_kafka import Consumer, KafkaException, KafkaError, OFFSET_BEGINNING, OFFSET_END, OFFSET_STORED
+from common import MICROS
+from bundle import unbundle
+from flow import ip_addresses
+
+finished = threading.Event()
+
+# how often the indexer writes what it has indexed to disk
+FLUSH_SECS = 5
+
+# offsets of a host that are no further apart than this are read as a single range, rather than seeking
+MAX_OFFSET_GAP = 64
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value INTEGER)",
+    "CREATE TABLE IF NOT EXISTS progress (partition INTEGER PRIMARY KEY, next_offset INTEGER)",
+    "CREATE TABLE IF NOT EXISTS buckets (bucket INTEGER, partition INTEGER, first_offset INTEGER, "
+    "last_offset INTEGER, PRIMARY KEY (bucket, partition))",
+    "CREATE TABLE IF NOT EXISTS hosts (address BLOB, bucket INTEGER, partition INTEGER, first_offset INTEGER, "
+    "offsets BLOB)",
+    "CREATE INDEX IF NOT EXISTS hosts_address ON hosts (address, bucket)"
+]
+
+
+def signal_handler(signum, frame):
+    """ Initiates a clean shutdown for a SIGINT """
+
+    finished.set()
+    logging.debug("Clean shutdown process started")
+
+
+def encode_offsets(offsets):
+    """ Returns the first offset and a compressed bitmap of all offsets relative to it. """
+
+    first = min(offsets)
+    bitmap = bytearray((max(offsets) - first) / 8 + 1)
+    for offset in offsets:
+        delta = offset - first
+        bitmap[delta >> 3] |= 1 << (delta & 7)
+    return (first, buffer(zlib.compress(bytes(bitmap))))
+
+
+def decode_offsets(first, offsets):
+    """ Returns each offset in a compressed bitmap of offsets relative to the first. """
+
+    bitmap = bytearray(zlib.decompress(bytes(offsets)))
+    for (idx, byte) in enumerate(bitmap):
+        if byte:
+            for bit in range(8):
+                if byte & (1 << bit):
+                    yield first + idx * 8 + bit
+
+
+def merge_ranges(ranges, max_gap=MAX_OFFSET_GAP):
+    """ Merges (first, last) offset ranges that overlap or are close, reading across small gaps rather than seeking. """
+
+    merged = []
+    for (first, last) in sorted(ranges):
+        if merged and first - merged[-1][1] <= max_gap:
+            merged[-1][1] = max(merged[-1][1], last)
+        else:
+            merged.append([first, last])
+    return [tuple(r) for r in merged]
+
+
+class PacketIndex(object):
+    """
+    An index of the packets in a topic, stored in SQLite.  For each bucket of time, the index holds the
+    range of offsets in each partition with packets captured within it and, optionally, a compressed
+    bitmap of the offsets with packets to or from each IP address.
+    """
+
+    def __init__(self, path, bucket_secs=60):
+        self.db = sqlite3.connect(path)
+        for statement in SCHEMA:
+            self.db.execute(statement)
+
+        # the bucket size is fixed once the index is created
+        self.db.execute("INSERT OR IGNORE INTO settings VALUES ('bucket_secs', ?)", (bucket_secs,))
+        self.bucket_secs = self.db.execute("SELECT value FROM settings WHERE name = 'bucket_secs'").fetchone()[0]
+        self.db.commit()
+
+        self.buckets = {}
+        self.hosts = {}
+        self.next_offsets = {}
+
+    def add(self, partition, offset, ts_secs, addresses=None):
+        """ Adds a packet, with the offset of the message that contains it. """
+
+        bucket = int(ts_secs) / self.bucket_secs
+        offsets = self.buckets.get((bucket, partition))
+        if offsets is None:
+            self.buckets[(bucket, partition)] = [offset, offset]
+        else:
+            offsets[0] = min(offsets[0], offset)
+            offsets[1] = max(offsets[1], offset)
+
+        if addresses is not None:
+            for address in addresses:
+                self.hosts.setdefault((address, bucket, partition), set()).add(offset)
+
+    def indexed(self, partition, offset):
+        """ Records that all messages of a partition up to and including an offset have been indexed. """
+
+        self.next_offsets[partition] = offset + 1
+
+    def flush(self):
+        """ Writes everything indexed since the last flush to disk, in a single transaction. """
+
+        with self.db:
+            for ((bucket, partition), (first, last)) in self.buckets.iteritems():
+                self.db.execute("INSERT OR IGNORE INTO buckets VALUES (?, ?, ?, ?)", (bucket, partition, first, last))
+                self.db.execute("UPDATE buckets SET first_offset = MIN(first_offset, ?), last_offset = MAX(last_offset, ?) "
+                                "WHERE bucket = ? AND partition = ?", (first, last, bucket, partition))
+
+            for ((address, bucket, partition), offsets) in self.hosts.iteritems():
+                (first, bitmap) = encode_offsets(offsets)
+                self.db.execute("INSERT INTO hosts VALUES (?, ?, ?, ?, ?)",
+                                (buffer(address), bucket, partition, first, bitmap))
+
+            for (partition, next_offset) in self.next_offsets.iteritems():
+                self.db.execute("INSERT OR REPLACE INTO progress VALUES (?, ?)", (partition, next_offset))
+
+        self.buckets.clear()
+        self.hosts.clear()
+
+    def progress(self):
+        """ Returns the next offset to index for each partition. """
+
+        return dict(self.db.execute("SELECT partition, next_offset FROM progress"))
+
+    def ranges(self, start_secs=None, end_secs=None, address=None):
+        """
+        Returns the (partition, first offset, last offset) ranges of the messages that may contain packets
+        captured between the start and end times and, if an address is given, to or from that address.
+        """
+
+        first_bucket = int(start_secs) / self.bucket_secs if start_secs is not None else 0
+        last_bucket = int(end_secs) / self.bucket_secs if end_secs is not None else (1 << 62)
+
+        ranges = {}
+        if address is None:
+            rows = self.db.execute("SELECT partition, first_offset, last_offset FROM buckets "
+                                   "WHERE bucket BETWEEN ? AND ?", (first_bucket, last_bucket))
+            for (partition, first, last) in rows:
+                ranges.setdefault(partition, []).append((first, last))
+        else:
+            rows = self.db.execute("SELECT partition, first_offset, offsets FROM hosts "
+                                   "WHERE address = ? AND bucket BETWEEN ? AND ?",
+                                   (buffer(address), first_bucket, last_bucket))
+            for (partition, first, bitmap) in rows:
+                ranges.setdefault(partition, []).extend((offset, offset) for offset in decode_offsets(first, bitmap))
+
+        return [(partition, first, last) for partition in sorted(ranges)
+                for (first, last) in merge_ranges(ranges[partition])]
+
+    def close(self):
+        self.db.close()
+
+
+def indexer(args, poll_timeout=3.0):
+    """ Consumes packets from a Kafka topic and maintains an index of them. """
+
+    # setup the signal handler
+    signal.signal(signal.SIGINT, signal_handler)
+
+    logging.info("Opening index; path=%s, bucket_secs=%d, hosts=%s", args.index, args.index_bucket,
+                 args.index_hosts)
+    index = PacketIndex(args.index, args.index_bucket)
+    progress = index.progress()
+
+    # resume each partition where the index left off; otherwise, start where asked
+    kafka_offsets = {
+        "begin": OFFSET_BEGINNING,
+        "end": OFFSET_END,
+        "stored": OFFSET_STORED
+    }
+
+    def on_assign(consumer, partitions):
+        for p in partitions:
+            p.offset = progress.get(p.partition, kafka_offsets[args.kafka_offset])
+            logging.info("Indexing partition; partition=%d, offset=%d", p.partition, p.offset)
+        consumer.assign(partitions)
+
+    # connect to kafka
+    logging.debug("Connecting to Kafka; %s", args.kafka_configs)
+    kafka_consumer = Consumer(args.kafka_configs)
+    kafka_consumer.subscribe([args.kafka_topic], on_assign=on_assign)
+
+    try:
+        msgs_in = 0
+        flushed = time.time()
+        while not finished.is_set():
+
+            msgs = kafka_consumer.consume(num_messages=args.batch_size, timeout=poll_timeout)
+            for msg in msgs:
+
+                if msg.error():
+                    if msg.error().code() != KafkaError._PARTITION_EOF:
+                        raise KafkaException(msg.error())
+                    continue
+
+                # index the time and, optionally, the addresses of each packet in the message
+                (partition, offset) = (msg.partition(), msg.offset())
+                for (ts, wirelen, pkt_raw) in unbundle(msg.key(), msg.value(), MICROS):
+                    addresses = ip_addresses(pkt_raw) if args.index_hosts else None
+                    index.add(partition, offset, ts / MICROS, addresses)
+
+                index.indexed(partition, offset)
+                msgs_in += 1
+
+            if time.time() - flushed >= FLUSH_SECS:
+                index.flush()
+                flushed = time.time()
+                logging.debug("Index flushed: msgs_in=%d", msgs_in)
+
+    finally:
+        index.flush()
+        index.close()
+        kafka_consumer.close()
+        logging.info("'%d' message(s) indexed", msgs_in)
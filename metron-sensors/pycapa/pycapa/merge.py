@@ -0,0 +1,147 @@
+#
+#  Licensed to the Apache Software Foundation (ASF) under one or more
+#  contributor license agreements.  See the NOTICE file distributed with
+#  this work for additional information regarding copyright ownership.
+#  The ASF licenses this file to You under the Apache License, Version 2.0
+#  (the "License"); you may not use this file except in compliance with
+#  the License.  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import heapq
+import threading
+import Queue
+import logging
+from confluent_kafka import Consumer, KafkaException, KafkaError, TopicPartition
+from bundle import unbundle
+
+
+class PartitionReader(threading.Thread):
+    """
+    Reads the packets of a single partition with its own Kafka consumer, in a background thread, until
+    the partition reaches its end or passes the end of its time window.  Packets are handed over in
+    batches through a bounded queue, so that a reader cannot get too far ahead of the merge.
+    """
+
+    def __init__(self, kafka_configs, topic, partition, seek, window, precision, batch_size, poll_timeout,
+                 max_batches=64):
+        threading.Thread.__init__(self, name="partition-%d" % partition)
+        self.daemon = True
+        self.kafka_configs = dict(kafka_configs)
+        self.topic = topic
+        self.partition = partition
+        self.seek = seek
+        self.window = window
+        self.precision = precision
+        self.batch_size = batch_size
+        self.poll_timeout = poll_timeout
+        self.batches = Queue.Queue(max_batches)
+        self.cancelled = threading.Event()
+        self.error = None
+
+        # the end of the partition marks the end of its packets
+        self.kafka_configs["enable.partition.eof"] = True
+
+    def run(self):
+        kafka_consumer = Consumer(self.kafka_configs)
+        try:
+            self.seek(kafka_consumer, [TopicPartition(self.topic, self.partition)])
+            done = False
+            while not done and not self.cancelled.is_set():
+
+                packets = []
+                msgs = kafka_consumer.consume(num_messages=self.batch_size, timeout=self.poll_timeout)
+                for msg in msgs:
+                    if msg.error():
+                        if msg.error().code() != KafkaError._PARTITION_EOF:
+                            raise KafkaException(msg.error())
+                        logging.info("Reached end of partition; partition=%d, offset=%s", self.partition,
+                                     msg.offset())
+                        done = True
+                        break
+
+                    elif self.window is not None and self.window.is_past_end(kafka_consumer, msg):
+                        done = True
+                        break
+
+                    for (ts, wirelen, pkt_raw) in unbundle(msg.key(), msg.value(), self.precision):
+                        if self.window is None or self.window.contains(ts):
+                            packets.append((ts, self.partition, wirelen, pkt_raw))
+
+                if packets:
+                    self.put(packets)
+
+        except Exception as e:
+            logging.error("Unable to read partition '%d'; %s", self.partition, e)
+            self.error = e
+
+        finally:
+            kafka_consumer.close()
+            self.put(None)
+
+    def put(self, batch):
+        """ Hands over a batch of packets, waiting while the queue is full, unless reading was stopped. """
+
+        while True:
+            try:
+                self.batches.put(batch, timeout=0.1)
+                return
+            except Queue.Full:
+                if self.cancelled.is_set() and batch is not None:
+                    return
+
+    def packets(self, finished):
+        """ Returns the packets read from the partition, in the order read, until finished. """
+
+        while not finished.is_set():
+            # wait with a timeout, so that a signal can interrupt the wait
+            try:
+                batch = self.batches.get(timeout=0.5)
+            except Queue.Empty:
+                continue
+            if batch is None:
+                break
+            for packet in batch:
+                yield packet
+
+        if self.error is not None:
+            raise self.error
+
+    def stop(self):
+        """ Stops reading the partition. """
+
+        self.cancelled.set()
+        while self.is_alive():
+            # drain the queue, so that the reader is not left waiting to hand over a batch
+            try:
+                self.batches.get(timeout=0.1)
+            except Queue.Empty:
+                pass
+
+
+def partitions(kafka_configs, topic, timeout=10.0):
+    """ Returns the partitions of a topic. """
+
+    kafka_consumer = Consumer(kafka_configs)
+    try:
+        metadata = kafka_consumer.list_topics(topic, timeout=timeout).topics[topic]
+        if metadata.error is not None:
+            raise KafkaException(metadata.error)
+        return sorted(metadata.partitions.keys())
+    finally:
+        kafka_consumer.close()
+
+
+def merge(readers, finished):
+    """
+    Merges the packets of each partition into a single stream, ordered by timestamp.  Each partition is
+    expected to be in time order already, so only the next packet of each partition need be compared.
+    """
+
+    return heapq.merge(*[reader.packets(finished) for reader in readers])
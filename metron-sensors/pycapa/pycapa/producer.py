@@ -14,18 +14,63 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
+import os
 import sys
+import socket
+import struct
 import threading
+import multiprocessing
+import Queue
 import signal
+import time
 import pcapy
 import argparse
 import random
 import logging
-from common import to_date, to_hex, pack_ts, unpack_ts
+from common import to_date, to_hex, pack_ts, MICROS, NANOS, TS_PRECISIONS
+from bundle import Bundle, packet_count, unpack_key
+from ring import RingCapture, RingHeader
+from replay import PcapReplay, list_pcaps
+from spill import SpillQueue, SpillingProducer
+from stats import ProducerStats
+from flow import flow_hash
 from confluent_kafka import Producer
 
 finished = threading.Event()
-producer_args = None
+
+# linux packet socket options used to share an interface among capture processes
+SOL_PACKET = 263
+PACKET_FANOUT = 18
+PACKET_FANOUT_FLAG_DEFRAG = 0x8000
+PACKET_FANOUT_MODES = {
+    "hash": 0,
+    "lb": 1,
+    "cpu": 2
+}
+
+# kafka producer settings tuned for sustained throughput, for low latency or for durability; any of
+# these may be overridden with '-X'.  settings left out keep the defaults of librdkafka
+PRODUCER_PROFILES = {
+    "throughput": {
+        "linger.ms": "50",
+        "compression.type": "lz4",
+        "queue.buffering.max.messages": "1000000",
+        "acks": "1"
+    },
+    "latency": {
+        "linger.ms": "0",
+        "batch.num.messages": "100",
+        "compression.type": "none",
+        "queue.buffering.max.kbytes": "65536",
+        "acks": "1"
+    },
+    "durable": {
+        "linger.ms": "10",
+        "compression.type": "zstd",
+        "acks": "all",
+        "enable.idempotence": "true"
+    }
+}
 
 def signal_handler(signum, frame):
     """ Initiates a clean shutdown for a SIGINT """
@@ -41,79 +86,337 @@ def partitioner(key_bytes, all_parts, avail_parts):
 
 
 def timestamp(pkt_hdr):
-    """ Returns the timestamp of the packet in epoch milliseconds. """
+    """ Returns the timestamp of the packet in epoch microseconds. """
+
+    (epoch_secs, delta_micros) = pkt_hdr.getts()
+    return epoch_secs * 1000000 + delta_micros
+
+
+def timestamp_nanos(pkt_hdr):
+    """ Returns the timestamp of the packet in epoch nanoseconds. """
 
     (epoch_secs, delta_micros) = pkt_hdr.getts()
-    epoch_micros = (epoch_secs * 1000000.0) + delta_micros
-    return epoch_micros
+    return epoch_secs * 1000000000 + delta_micros * 1000
+
+
+def timestamper(capture, precision):
+    """ Returns the function that timestamps each packet captured, with the given precision. """
 
+    if precision == MICROS:
+        return timestamp
+    elif getattr(capture, "precision", MICROS) == NANOS:
+        return RingHeader.getts_nanos
 
-def delivery_callback(err, msg):
-    """ Callback executed when message delivery either succeeds or fails. """
+    logging.warn("libpcap only provides microsecond timestamps; nanosecond timestamps will be padded")
+    return timestamp_nanos
 
-    # initialize counter, if needed
-    if not hasattr(delivery_callback, "pkts_out"):
-         delivery_callback.pkts_out = 0
 
-    if err:
-        logging.error("message delivery failed: error=%s", err)
+def open_capture(args, timeout_ms, promisc, worker=0):
+    """ Opens the backend that captures packets from the network interface or replays pcap files. """
 
-    elif msg is not None:
-        delivery_callback.pkts_out += 1
+    # when replaying, each worker replays its share of the files
+    if args.pcap_files or args.pcap_dir:
+        return PcapReplay(list_pcaps(args.pcap_files, args.pcap_dir)[worker::args.workers], args.snaplen, args.rate)
+
+    elif args.capture_backend == "ring":
+        try:
+            return RingCapture(args.interface, args.snaplen, promisc, timeout_ms, args.ring_size)
+        except (socket.error, EnvironmentError) as e:
+            logging.warn("Unable to capture with a TPACKET_V3 ring, falling back to libpcap; %s", e)
+
+    return pcapy.open_live(args.interface, args.snaplen, promisc, timeout_ms)
+
+
+def join_fanout(capture, fanout_id, fanout_mode):
+    """ Joins the capture socket to a PACKET_FANOUT group, which shares packets among all of its members. """
+
+    fanout_type = PACKET_FANOUT_MODES[fanout_mode]
+    if fanout_mode == "hash":
+        # ensure fragments of a packet are hashed to the same member
+        fanout_type |= PACKET_FANOUT_FLAG_DEFRAG
+
+    sock = socket.fromfd(capture.getfd(), socket.AF_PACKET, socket.SOCK_RAW)
+    try:
+        sock.setsockopt(SOL_PACKET, PACKET_FANOUT, struct.pack("I", (fanout_type << 16) | fanout_id))
+    finally:
+        sock.close()
 
-        pretty_print = 0
-        pretty_print = producer_args.pretty_print
 
-        if pretty_print > 0 and delivery_callback.pkts_out % pretty_print == 0:
-            print 'Packet delivered[%s]: date=%s topic=%s partition=%s offset=%s len=%s' % (
-                delivery_callback.pkts_out, to_date(unpack_ts(msg.key())), msg.topic(),
-                msg.partition(), msg.offset(), len(msg.value()))
+class DeliveryCallback(object):
+    """
+    Counts the packets delivered to Kafka.  When every delivery is reported, the packets delivered
+    are counted as each delivery is reported.  Otherwise, only failed deliveries are reported and
+    the packets delivered are those sent less those that failed.
+    """
 
+    def __init__(self, pretty_print=0, stats=None):
+        self.pretty_print = pretty_print
+        self.stats = stats
+        self.pkts_out = 0
+        self.pkts_failed = 0
 
-def producer(args, sniff_timeout_ms=500, sniff_promisc=True):
+    def __call__(self, err, msg):
+        """ Callback executed when message delivery either succeeds or fails. """
+
+        if err:
+            logging.error("message delivery failed: error=%s", err)
+            self.pkts_failed += packet_count(msg.key())
+            if self.stats is not None:
+                self.stats.record_error()
+
+        elif msg is not None:
+            pkts_msg = packet_count(msg.key())
+            self.pkts_out += pkts_msg
+            if self.stats is not None:
+                self.stats.record_delivery(msg)
+
+            pretty_print = self.pretty_print
+            if pretty_print > 0 and self.pkts_out / pretty_print > (self.pkts_out - pkts_msg) / pretty_print:
+                (ts, precision, _) = unpack_key(msg.key())
+                print 'Packet delivered[%s]: date=%s topic=%s partition=%s offset=%s len=%s' % (
+                    self.pkts_out, to_date(ts, precision), msg.topic(),
+                    msg.partition(), msg.offset(), len(msg.value()))
+
+
+def producer(args, sniff_timeout_ms=500, sniff_promisc=True, fanout_id=None, worker=0):
     """ Captures packets from a network interface and sends them to a Kafka topic. """
 
     # setup the signal handler
     signal.signal(signal.SIGINT, signal_handler)
 
-    global producer_args
-    producer_args = args
+    # optionally, report live statistics; each worker reports its own
+    producer_stats = None
+    if args.stats_file or args.stats_port:
+        stats_path = args.stats_file
+        if stats_path and args.workers > 1:
+            stats_path = "%s.%d" % (stats_path, worker)
+        stats_port = args.stats_port + worker if args.stats_port else None
+        logging.info("Reporting stats; path=%s, port=%s, interval_secs=%d", stats_path, stats_port,
+                     args.stats_interval)
+        producer_stats = ProducerStats(args.stats_interval, stats_path, stats_port)
+
+    # optionally, spill messages to disk when kafka falls behind; each worker needs its own spill file
+    spill = None
+    if args.spill_file:
+        spill_path = args.spill_file if args.workers == 1 else "%s.%d" % (args.spill_file, worker)
+        logging.info("Spilling to disk when Kafka falls behind; path=%s, max_mb=%d", spill_path, args.spill_size)
+        spill = SpillQueue(spill_path, args.spill_size << 20)
+
+    # unless pretty printing each delivery, account for deliveries in aggregate rather than once per message
+    kafka_configs = dict(args.kafka_configs)
+    delivery_callback = DeliveryCallback(args.pretty_print, producer_stats)
+    report_each = args.pretty_print > 0
+    if not report_each:
+        kafka_configs.setdefault("delivery.report.only.error", "true")
+        if producer_stats is not None:
+            kafka_configs["stats_cb"] = producer_stats.record_kafka_stats
+            kafka_configs.setdefault("statistics.interval.ms", args.stats_interval * 1000)
 
     # connect to kafka
-    logging.info("Connecting to Kafka; %s", args.kafka_configs)
-    kafka_producer = Producer(args.kafka_configs)
+    logging.info("Connecting to Kafka; %s", kafka_configs)
+    max_queued = int(kafka_configs.get("queue.buffering.max.messages", 100000))
+    kafka_producer = SpillingProducer(Producer(kafka_configs), args.kafka_topic, delivery_callback, spill,
+                                      max_queued)
+
+    def delivered():
+        """ Returns the number of packets delivered to Kafka. """
 
-    # initialize packet capture
-    logging.info("Starting packet capture")
-    capture = pcapy.open_live(args.interface, args.snaplen, sniff_promisc, sniff_timeout_ms)
+        if report_each:
+            return delivery_callback.pkts_out
+        return kafka_producer.pkts_sent - kafka_producer.pkts_queued() - delivery_callback.pkts_failed
+
+    # initialize packet capture; when batching, the read timeout bounds how long a batch may take to fill
+    logging.info("Starting packet capture; backend=%s", args.capture_backend)
+    timeout_ms = args.batch_timeout if args.batch_size > 1 else sniff_timeout_ms
+    capture = open_capture(args, timeout_ms, sniff_promisc, worker)
+    replaying = isinstance(capture, PcapReplay)
+
+    # filter and truncate packets in the kernel, before they are copied to user space
+    if args.filter:
+        logging.info("Applying capture filter; filter='%s', snaplen=%d", args.filter, args.snaplen)
+        capture.setfilter(args.filter)
+
+    if fanout_id is not None:
+        logging.info("Joining fanout group; id=%d, mode=%s", fanout_id, args.fanout)
+        join_fanout(capture, fanout_id, args.fanout)
     pkts_in = 0
 
+    # timestamp packets with integer math only; nanosecond timestamps need a versioned key
+    precision = TS_PRECISIONS[args.timestamp_precision]
+    packet_ts = timestamper(capture, precision)
+
+    # optionally, keep all packets of a flow in the same partition
+    partitions = 0
+    if args.partition_by == "flow":
+        partitions = kafka_producer.partitions()
+        logging.info("Partitioning packets by flow; partitions=%d", partitions)
+        if partitions == 0:
+            logging.warn("Unable to find the partitions of topic '%s'; packets will not be partitioned by flow",
+                         args.kafka_topic)
+
+    # optionally, bundle multiple packets into each message; with one bundle per partition
+    bundles = None
+    if args.bundle_size > 0:
+        logging.info("Bundling packets; max_bytes=%d, max_ms=%d", args.bundle_size, args.bundle_timeout)
+        bundles = {}
+
+    # when the oldest partial bundle will have aged out
+    next_bundle_check = 0
+
+    def send_bundle(partition):
+        """ Sends all packets in a bundle to Kafka as a single message. """
+
+        bundle = bundles[partition]
+        pkts = len(bundle)
+        (key, value) = bundle.pop()
+        kafka_producer.produce(key, value, pkts, partition)
+
+    def send_packet(pkt_hdr, pkt_raw):
+        """ Sends a captured packet to Kafka. """
+
+        # without a partition, the producer chooses one
+        partition = -1
+        if partitions > 0:
+            pkt_hash = flow_hash(pkt_raw)
+            if pkt_hash is not None:
+                partition = pkt_hash % partitions
+
+        if bundles is not None:
+            bundle = bundles.get(partition)
+            if bundle is None:
+                bundle = bundles[partition] = Bundle(args.bundle_size, args.bundle_timeout, precision)
+            bundle.append(packet_ts(pkt_hdr), pkt_hdr.getlen(), pkt_raw)
+            if bundle.is_full():
+                send_bundle(partition)
+        else:
+            kafka_producer.produce(pack_ts(packet_ts(pkt_hdr), precision), pkt_raw, partition=partition)
+
     try:
         while not finished.is_set() and (args.max_packets <= 0 or pkts_in < args.max_packets):
 
-            # capture a packet
-            (pkt_hdr, pkt_raw) = capture.next()
-            if pkt_hdr is not None:
-                logging.debug("Packet received: pkts_in=%d, pkt_len=%s", pkts_in, pkt_hdr.getlen())
-                pkts_in += 1
-                pkt_ts = timestamp(pkt_hdr)
-                kafka_producer.produce(args.kafka_topic, key=pack_ts(pkt_ts), value=pkt_raw, callback=delivery_callback)
+            # stop once every pcap file has been replayed
+            if replaying and capture.is_finished():
+                break
+
+            if args.batch_size > 1:
+
+                # capture a batch of packets, never exceeding 'max-packets'
+                batch_size = args.batch_size
+                if args.max_packets > 0:
+                    batch_size = min(batch_size, args.max_packets - pkts_in)
+
+                pkts_batch = capture.dispatch(batch_size, send_packet)
+                logging.debug("Batch received: pkts_in=%d, pkts_batch=%d", pkts_in, pkts_batch)
+                pkts_in += pkts_batch
 
                 # pretty print, if needed
-                if args.pretty_print > 0 and pkts_in % args.pretty_print == 0:
+                if args.pretty_print > 0 and pkts_in / args.pretty_print > (pkts_in - pkts_batch) / args.pretty_print:
                     print 'Packet received[%s]' % (pkts_in)
 
-            # serve the callback queue
+            else:
+
+                # capture a packet
+                (pkt_hdr, pkt_raw) = capture.next()
+                if pkt_hdr is not None:
+                    logging.debug("Packet received: pkts_in=%d, pkt_len=%s", pkts_in, pkt_hdr.getlen())
+                    pkts_in += 1
+                    send_packet(pkt_hdr, pkt_raw)
+
+                    # pretty print, if needed
+                    if args.pretty_print > 0 and pkts_in % args.pretty_print == 0:
+                        print 'Packet received[%s]' % (pkts_in)
+
+            # send any partial bundles once they have aged out; only scanning them once the oldest is due
+            if bundles is not None:
+                now = time.time()
+                if now >= next_bundle_check:
+                    next_bundle_check = now + args.bundle_timeout / 1000.0
+                    for (partition, bundle) in bundles.iteritems():
+                        if bundle.is_ready(now):
+                            send_bundle(partition)
+                        elif len(bundle) > 0:
+                            next_bundle_check = min(next_bundle_check, bundle.started + bundle.max_secs)
+
+            # serve the callback queue; once per packet or once per batch
             kafka_producer.poll(0)
+            kafka_producer.drain()
+
+            if producer_stats is not None:
+                producer_stats.update(pkts_in, delivered(), capture, kafka_producer)
 
     finally:
+        # send any partial bundles
+        if bundles is not None:
+            for (partition, bundle) in bundles.iteritems():
+                if len(bundle) > 0:
+                    send_bundle(partition)
+
         # flush all messages
         logging.info("Waiting for '%d' message(s) to flush", len(kafka_producer))
         kafka_producer.flush()
 
-        # pkts_out may not be initialized if the callback was never executed
-        pkts_out = 0
-        if hasattr(delivery_callback, "pkts_out"):
-            pkts_out = delivery_callback.pkts_out
-
+        pkts_out = delivered()
         logging.info("'%d' packet(s) in, '%d' packet(s) out", pkts_in, pkts_out)
+        logging.info("'%d' packet(s) spilled to disk, '%d' packet(s) dropped", kafka_producer.pkts_spilled,
+                     kafka_producer.pkts_dropped)
+
+        if producer_stats is not None:
+            producer_stats.update(pkts_in, pkts_out, capture, kafka_producer, force=True)
+            producer_stats.close()
+        kafka_producer.close()
+
+        (pkts_recv, pkts_drop, pkts_ifdrop) = capture.stats()
+        logging.info("Filter '%s'; '%d' packet(s) matched, '%d' dropped by kernel, '%d' dropped by interface",
+                     args.filter or "", pkts_recv, pkts_drop, pkts_ifdrop)
+
+    return (pkts_in, pkts_out)
+
+
+def producer_worker(args, fanout_id, worker, results):
+    """ Captures or replays packets as one of many workers and reports the packet counts when done. """
+
+    (pkts_in, pkts_out) = producer(args, fanout_id=fanout_id, worker=worker)
+    results.put((pkts_in, pkts_out))
+
+
+def producers(args):
+    """
+    Captures packets with multiple processes that share a network interface through PACKET_FANOUT or,
+    when replaying, that share the pcap files among them.
+    """
+
+    # the workers inherit the signal handler, but the supervisor is responsible for a clean shutdown
+    signal.signal(signal.SIGINT, signal_handler)
+
+    # each worker creates its own capture and kafka producer; only a live capture joins a fanout group
+    fanout_id = None if args.pcap_files or args.pcap_dir else os.getpid() & 0xffff
+    results = multiprocessing.Queue()
+    workers = []
+    for idx in range(args.workers):
+        worker = multiprocessing.Process(target=producer_worker, args=(args, fanout_id, idx, results))
+        worker.start()
+        workers.append(worker)
+    logging.info("Started '%d' capture worker(s)", len(workers))
+
+    # wait for all workers to finish or a shutdown to be requested
+    while any(worker.is_alive() for worker in workers):
+        if finished.wait(1.0):
+            for worker in workers:
+                if worker.is_alive():
+                    os.kill(worker.pid, signal.SIGINT)
+            break
+
+    for worker in workers:
+        worker.join()
+
+    # aggregate the packet counts reported by each worker
+    pkts_in = pkts_out = 0
+    try:
+        for _ in workers:
+            (worker_in, worker_out) = results.get(timeout=1.0)
+            pkts_in += worker_in
+            pkts_out += worker_out
+    except Queue.Empty:
+        logging.error("Packet counts are missing for one or more workers")
+
+    logging.info("'%d' packet(s) in, '%d' packet(s) out across '%d' worker(s)", pkts_in, pkts_out, len(workers))
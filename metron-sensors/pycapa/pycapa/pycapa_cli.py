@@ -15,11 +15,16 @@
 #  limitations under the License.
 #
 import argparse
+import calendar
 import logging
+import os
 import random
 import string
-from producer import producer
+import time
+from producer import producer, producers, PACKET_FANOUT_MODES, PRODUCER_PROFILES
+from common import TS_PRECISIONS
 from consumer import consumer
+from indexer import indexer
 
 
 def make_parser():
@@ -38,6 +43,12 @@ def make_parser():
                         action='store_true',
                         default=False)
 
+    parser.add_argument('-ix', '--indexer',
+                        help='read packets from kafka and maintain an index of them',
+                        dest='indexer',
+                        action='store_true',
+                        default=False)
+
     parser.add_argument('-k', '--kafka-broker',
                         help='kafka broker(s) as host:port',
                         dest='kafka_brokers')
@@ -86,6 +97,197 @@ def make_parser():
                         type=int,
                         default=65535)
 
+    parser.add_argument('-F', '--filter',
+                        help="capture, or consume, only packets matching this BPF filter expression",
+                        dest='filter',
+                        metavar='BPF_FILTER')
+
+    parser.add_argument('-b', '--batch-size',
+                        help="capture up to X packets per read from the interface, or consume up to X messages "
+                             "per read from kafka; default=1",
+                        dest='batch_size',
+                        type=int,
+                        default=1)
+
+    parser.add_argument('-bt', '--batch-timeout',
+                        help="wait at most X milliseconds for a batch to fill; default=500",
+                        dest='batch_timeout',
+                        type=int,
+                        default=500)
+
+    parser.add_argument('-w', '--workers',
+                        help="capture with X processes that share the interface; default=1",
+                        dest='workers',
+                        type=int,
+                        default=1)
+
+    parser.add_argument('-fo', '--fanout',
+                        help="how packets are shared among workers; default=hash",
+                        dest='fanout',
+                        choices=sorted(PACKET_FANOUT_MODES.keys()),
+                        default='hash')
+
+    parser.add_argument('-bs', '--bundle-size',
+                        help="bundle packets into messages of up to X bytes, which only 'pycapa --consumer' can "
+                             "read; default=0 (disabled)",
+                        dest='bundle_size',
+                        type=int,
+                        default=0)
+
+    parser.add_argument('-bst', '--bundle-timeout',
+                        help="send a partial bundle after X milliseconds; default=100",
+                        dest='bundle_timeout',
+                        type=int,
+                        default=100)
+
+    parser.add_argument('-cb', '--capture-backend',
+                        help="capture with libpcap or a memory-mapped TPACKET_V3 ring; default=pcapy",
+                        dest='capture_backend',
+                        choices=['pcapy', 'ring'],
+                        default='pcapy')
+
+    parser.add_argument('-rs', '--ring-size',
+                        help="size of the TPACKET_V3 ring in megabytes; default=64",
+                        dest='ring_size',
+                        type=int,
+                        default=64)
+
+    parser.add_argument('-sf', '--spill-file',
+                        help="spill packets to this file while kafka falls behind",
+                        dest='spill_file')
+
+    parser.add_argument('-ss', '--spill-size',
+                        help="maximum size of the spill file in megabytes; default=1024",
+                        dest='spill_size',
+                        type=int,
+                        default=1024)
+
+    parser.add_argument('-sj', '--stats-file',
+                        help="periodically write producer stats as JSON to this file",
+                        dest='stats_file')
+
+    parser.add_argument('-sp', '--stats-port',
+                        help="serve producer stats as JSON over HTTP on this local port",
+                        dest='stats_port',
+                        type=int)
+
+    parser.add_argument('-si', '--stats-interval',
+                        help="report producer stats every X seconds; default=10",
+                        dest='stats_interval',
+                        type=int,
+                        default=10)
+
+    parser.add_argument('-pb', '--partition-by',
+                        help="keep all packets of a flow in the same partition; default=none",
+                        dest='partition_by',
+                        choices=['none', 'flow'],
+                        default='none')
+
+    parser.add_argument('-pr', '--profile',
+                        help="tune the kafka producer for throughput, latency or durability; "
+                             "overridden by -X; default=none",
+                        dest='profile',
+                        choices=['none'] + sorted(PRODUCER_PROFILES.keys()),
+                        default='none')
+
+    parser.add_argument('-tp', '--timestamp-precision',
+                        help="precision of the packet timestamps sent or written; Metron's pcap topology reads nano "
+                             "timestamps only with 'kafka.pcap.ts_granularity=NANOSECONDS'; default=micro",
+                        dest='timestamp_precision',
+                        choices=sorted(TS_PRECISIONS.keys()),
+                        default='micro')
+
+    parser.add_argument('-pf', '--pcap-file',
+                        help="replay the packets in this pcap file rather than capture from an interface",
+                        dest='pcap_files',
+                        action='append')
+
+    parser.add_argument('-pd', '--pcap-dir',
+                        help="replay the packets in all pcap files in this directory, in name order",
+                        dest='pcap_dir')
+
+    parser.add_argument('-r', '--rate',
+                        help="replay at 'max' speed, 'original' speed or X times the original; default=max",
+                        dest='rate',
+                        type=rate,
+                        default='max')
+
+    parser.add_argument('-od', '--output-dir',
+                        help="write packets to rotated pcap files in this directory rather than to stdout",
+                        dest='output_dir')
+
+    parser.add_argument('-os', '--output-size',
+                        help="start a new pcap file once it reaches X megabytes; default=128",
+                        dest='output_size',
+                        type=int,
+                        default=128)
+
+    parser.add_argument('-oi', '--output-interval',
+                        help="start a new pcap file every X seconds; default=300",
+                        dest='output_interval',
+                        type=int,
+                        default=300)
+
+    parser.add_argument('-z', '--compress',
+                        help="compress each pcap file with gzip once it is closed",
+                        dest='compress',
+                        action='store_true',
+                        default=False)
+
+    parser.add_argument('-fs', '--flush-size',
+                        help="buffer up to X kilobytes of packets before writing them out; default=1024",
+                        dest='flush_size',
+                        type=int,
+                        default=1024)
+
+    parser.add_argument('-fi', '--flush-interval',
+                        help="write out buffered packets after at most X milliseconds; default=100",
+                        dest='flush_interval',
+                        type=int,
+                        default=100)
+
+    parser.add_argument('-st', '--start-time',
+                        help="consume packets captured from this time; epoch seconds or YYYY-MM-DDTHH:MM:SS UTC",
+                        dest='start_time',
+                        type=epoch_time)
+
+    parser.add_argument('-et', '--end-time',
+                        help="consume packets captured until this time; epoch seconds or YYYY-MM-DDTHH:MM:SS UTC",
+                        dest='end_time',
+                        type=epoch_time)
+
+    parser.add_argument('-mg', '--merge',
+                        help="read partitions in parallel and write packets in time order until each one ends",
+                        dest='merge',
+                        action='store_true',
+                        default=False)
+
+    parser.add_argument('-ex', '--extract',
+                        help="write only packets matching a BPF filter expression to a pcap file; path=filter",
+                        dest='extracts',
+                        type=extract,
+                        action='append')
+
+    parser.add_argument('-id', '--index',
+                        help="path of the packet index; maintained by --indexer, read by --consumer",
+                        dest='index')
+
+    parser.add_argument('-ib', '--index-bucket',
+                        help="index packets in buckets of X seconds; default=60",
+                        dest='index_bucket',
+                        type=int,
+                        default=60)
+
+    parser.add_argument('-ih', '--index-hosts',
+                        help="also index the IP addresses of each packet",
+                        dest='index_hosts',
+                        action='store_true',
+                        default=False)
+
+    parser.add_argument('-ho', '--host',
+                        help="consume only packets to or from this IP address; requires --index",
+                        dest='host')
+
     return parser
 
 
@@ -99,21 +301,76 @@ def keyval(input, delim="="):
     return keyval
 
 
+def extract(input):
+    """ Expects a single path=filter; the filter itself may contain '='. """
+
+    extract = input.split("=", 1)
+    if len(extract) != 2:
+        raise ValueError("expect path=filter")
+
+    return extract
+
+
+def rate(input):
+    """ Expects 'max', 'original' or a multiple of the original speed; returns the multiple or 0 for 'max'. """
+
+    if input == "max":
+        return 0.0
+    elif input == "original":
+        return 1.0
+
+    speed = float(input.rstrip("x"))
+    if speed <= 0:
+        raise ValueError("expect a speed greater than 0")
+
+    return speed
+
+
+def epoch_time(input):
+    """ Expects a time in epoch seconds or as YYYY-MM-DDTHH:MM:SS in UTC; returns epoch seconds. """
+
+    try:
+        return float(input)
+    except ValueError:
+        return calendar.timegm(time.strptime(input.replace(" ", "T"), "%Y-%m-%dT%H:%M:%S"))
+
+
 def valid_args(args):
     """ Validates the command-line arguments. """
 
-    if not args.producer and not args.consumer:
-        print "error: expected either --consumer or --producer \n"
+    if not args.producer and not args.consumer and not args.indexer:
+        print "error: expected either --consumer, --producer or --indexer \n"
         return False
 
-    elif args.producer and not (args.kafka_brokers and args.kafka_topic and args.interface):
-        print "error: missing required args: expected [--kafka-broker, --kafka-topic, --interface] \n"
+    elif args.producer and not (args.kafka_brokers and args.kafka_topic and
+                                (args.interface or args.pcap_files or args.pcap_dir)):
+        print "error: missing required args: expected [--kafka-broker, --kafka-topic, --interface or --pcap-file or --pcap-dir] \n"
         return False
 
     elif args.consumer and not (args.kafka_brokers and args.kafka_topic):
         print "error: missing required args: expected [--kafka-broker, --kafka-topic] \n"
         return False
 
+    elif args.indexer and not (args.kafka_brokers and args.kafka_topic and args.index):
+        print "error: missing required args: expected [--kafka-broker, --kafka-topic, --index] \n"
+        return False
+
+    elif args.host and not args.index:
+        print "error: missing required args: expected [--index] with --host \n"
+        return False
+
+    elif args.merge and args.index:
+        print "error: invalid args: --merge cannot be used with --index \n"
+        return False
+
+    elif args.consumer and args.index and not os.path.isfile(args.index):
+        print "error: invalid args: no index found at --index %s \n" % args.index
+        return False
+
+    elif args.workers < 1:
+        print "error: invalid args: expected --workers of at least 1 \n"
+        return False
+
     else:
         return True
 
@@ -137,6 +394,11 @@ def clean_kafka_configs(args):
     if(group_key not in configs):
         configs[group_key] = ''.join(random.choice(string.ascii_uppercase) for _ in range(12))
 
+    # a producer profile fills in any settings not already defined with '-X'
+    if args.producer and args.profile in PRODUCER_PROFILES:
+        for (key, value) in PRODUCER_PROFILES[args.profile].iteritems():
+            configs.setdefault(key, value)
+
     args.kafka_configs = configs
 
 
@@ -156,6 +418,10 @@ def main():
         parser.print_help()
     elif args.consumer:
         consumer(args)
+    elif args.indexer:
+        indexer(args)
+    elif args.producer and args.workers > 1:
+        producers(args)
     elif args.producer:
         producer(args)
     else:
@@ -0,0 +1,213 @@
+#
+#  Licensed to the Apache Software Foundation (ASF) under one or more
+#  contributor license agreements.  See the NOTICE file distributed with
+#  this work for additional information regarding copyright ownership.
+#  The ASF licenses this file to You under the Apache License, Version 2.0
+#  (the "License"); you may not use this file except in compliance with
+#  the License.  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import os
+import mmap
+import struct
+import time
+import logging
+import pcapy
+from common import NANOS
+from ring import RingHeader, PCAP_NETMASK_UNKNOWN
+
+# the magic number of a libpcap file identifies its byte order and the precision of its timestamps
+PCAP_MAGIC_MICROS = 0xa1b2c3d4
+PCAP_MAGIC_NANOS = 0xa1b23c4d
+
+# the 'magic', 'version_major', 'version_minor', 'thiszone', 'sigfigs', 'snaplen' and 'network' fields
+GLOBAL_HEADER = "IHHiIII"
+
+# the 'ts_sec', 'ts_frac', 'incl_len' and 'orig_len' fields that precede each packet
+PACKET_HEADER = "IIII"
+
+
+def list_pcaps(pcap_files, pcap_dir):
+    """ Returns the path of each pcap file to replay; all files in a directory are replayed in name order. """
+
+    paths = list(pcap_files or [])
+    if pcap_dir:
+        for name in sorted(os.listdir(pcap_dir)):
+            path = os.path.join(pcap_dir, name)
+            if os.path.isfile(path):
+                paths.append(path)
+    return paths
+
+
+class PcapFile(object):
+    """ Reads the packets of a libpcap file through a read-only memory map. """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            # the byte order of the file is that of the host that wrote it
+            for byte_order in "<>":
+                (magic,) = struct.unpack_from(byte_order + "I", self.mm, 0)
+                if magic in (PCAP_MAGIC_MICROS, PCAP_MAGIC_NANOS):
+                    break
+            else:
+                raise ValueError("not a libpcap file: %s" % path)
+
+            global_header = struct.Struct(byte_order + GLOBAL_HEADER)
+            (_, _, _, _, _, self.snaplen, self.linktype) = global_header.unpack_from(self.mm, 0)
+            self.packet_header = struct.Struct(byte_order + PACKET_HEADER)
+            self.frac_nanos = 1 if magic == PCAP_MAGIC_NANOS else 1000
+            self.offset = global_header.size
+
+        except:
+            self.mm.close()
+            raise
+
+    def next(self, snaplen):
+        """ Returns the next packet, truncated to the snaplen, or (None, '') at the end of the file. """
+
+        if self.offset + self.packet_header.size > len(self.mm):
+            return (None, '')
+
+        (secs, frac, caplen, wirelen) = self.packet_header.unpack_from(self.mm, self.offset)
+        start = self.offset + self.packet_header.size
+        self.offset = start + caplen
+        if self.offset > len(self.mm):
+            logging.warn("Packet truncated at the end of '%s'", self.path)
+            return (None, '')
+
+        caplen = min(caplen, snaplen)
+        return (RingHeader(secs, frac * self.frac_nanos, caplen, wirelen), buffer(self.mm, start, caplen))
+
+    def close(self):
+        self.mm.close()
+
+
+class PcapReplay(object):
+    """
+    Replays the packets of one or more libpcap files, one file after another.  This mimics the capture
+    handle returned by pcapy.  Like the TPACKET_V3 ring, each packet is a read-only buffer that references
+    the file, which remains valid only until the next call to 'dispatch' or 'next'.  Packets are replayed
+    as fast as possible or, with a speed greater than zero, at that multiple of the speed captured.
+    """
+
+    # the timestamp precision of the packet headers
+    precision = NANOS
+
+    def __init__(self, paths, snaplen, speed=0.0):
+        self.paths = list(paths)
+        self.snaplen = snaplen
+        self.speed = speed
+        self.bpf_filter = None
+        self.program = None
+        self.pcap = None
+        self.pkts_read = 0
+        self.pkts_matched = 0
+
+        # when pacing, the wall clock time and timestamp of the first packet replayed
+        self.started = None
+        self.first_ts = None
+
+    def is_finished(self):
+        """ Returns true once every file has been replayed. """
+
+        return self.pcap is None and not self.paths
+
+    def setfilter(self, bpf_filter):
+        """ Compiles a BPF filter expression, which each packet is matched against as it is read. """
+
+        self.bpf_filter = bpf_filter
+        self.program = None
+        if self.pcap is not None:
+            self.compile()
+
+    def compile(self):
+        """ Compiles the BPF filter for the link type of the current file. """
+
+        if self.bpf_filter:
+            self.program = pcapy.compile(self.pcap.linktype, self.snaplen, self.bpf_filter, 1, PCAP_NETMASK_UNKNOWN)
+
+    def stats(self):
+        """ Returns the packets matched; none are ever dropped. """
+
+        return (self.pkts_matched, 0, 0)
+
+    def next(self):
+        """ Returns the next packet, or (None, '') once every file has been replayed. """
+
+        pkts = []
+        self.dispatch(1, lambda pkt_hdr, pkt_raw: pkts.append((pkt_hdr, pkt_raw)))
+        return pkts[0] if pkts else (None, '')
+
+    def dispatch(self, max_pkts, callback):
+        """ Invokes a callback for up to 'max_pkts' packets and returns the number of packets processed. """
+
+        pkts = 0
+        while pkts < max_pkts:
+            (pkt_hdr, pkt_raw) = self.read()
+            if pkt_hdr is None:
+                break
+
+            self.pkts_read += 1
+            if self.program is not None and not self.program.filter(str(pkt_raw)):
+                continue
+            self.pkts_matched += 1
+
+            if self.speed > 0:
+                self.pace(pkt_hdr)
+
+            callback(pkt_hdr, pkt_raw)
+            pkts += 1
+
+        return pkts
+
+    def read(self):
+        """ Reads the next packet, opening the next file as each is exhausted. """
+
+        while True:
+            if self.pcap is None:
+                if not self.paths:
+                    return (None, '')
+                path = self.paths.pop(0)
+                try:
+                    self.pcap = PcapFile(path)
+                except (ValueError, EnvironmentError, struct.error) as e:
+                    logging.error("Unable to replay '%s'; %s", path, e)
+                    continue
+                logging.info("Replaying pcap file; path=%s, linktype=%d", path, self.pcap.linktype)
+                self.compile()
+
+            (pkt_hdr, pkt_raw) = self.pcap.next(self.snaplen)
+            if pkt_hdr is not None:
+                return (pkt_hdr, pkt_raw)
+
+            self.pcap.close()
+            self.pcap = None
+
+    def pace(self, pkt_hdr):
+        """ Waits until a packet is due, based on the time elapsed since the first packet was captured. """
+
+        ts = pkt_hdr.getts_nanos()
+        if self.started is None:
+            self.started = time.time()
+            self.first_ts = ts
+            return
+
+        delay = (ts - self.first_ts) / (NANOS * self.speed) - (time.time() - self.started)
+        if delay > 0:
+            time.sleep(delay)
+
+    def close(self):
+        if self.pcap is not None:
+            self.pcap.close()
+            self.pcap = None
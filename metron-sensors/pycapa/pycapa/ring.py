@@ -0,0 +1,208 @@
+#
+#  Licensed to the Apache Software Foundation (ASF) under one or more
+#  contributor license agreements.  See the NOTICE file distributed with
+#  this work for additional information regarding copyright ownership.
+#  The ASF licenses this file to You under the Apache License, Version 2.0
+#  (the "License"); you may not use this file except in compliance with
+#  the License.  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import ctypes
+import fcntl
+import mmap
+import select
+import socket
+import struct
+import pcapy
+from common import NANOS
+
+# linux packet socket constants; see linux/if_packet.h
+SOL_PACKET = 263
+SO_ATTACH_FILTER = 26
+SIOCGIFINDEX = 0x8933
+ETH_P_ALL = 0x0003
+PACKET_ADD_MEMBERSHIP = 1
+PACKET_MR_PROMISC = 1
+PACKET_RX_RING = 5
+PACKET_STATISTICS = 6
+PACKET_VERSION = 10
+TPACKET_V3 = 2
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+PCAP_NETMASK_UNKNOWN = 0xffffffff
+
+# struct tpacket_req3
+RING_REQUEST = struct.Struct("IIIIIII")
+
+# the 'block_status', 'num_pkts' and 'offset_to_first_pkt' fields of struct tpacket_block_desc
+BLOCK_STATUS_OFFSET = 8
+BLOCK_HEADER = struct.Struct("III")
+
+# the 'tp_next_offset', 'tp_sec', 'tp_nsec', 'tp_snaplen', 'tp_len', 'tp_status' and 'tp_mac' fields of struct tpacket3_hdr
+PACKET_HEADER = struct.Struct("IIIIIIH")
+
+# struct tpacket_stats_v3
+RING_STATS = struct.Struct("III")
+
+
+class RingHeader(object):
+    """ The header of a packet captured from the ring; mimics the header returned by pcapy. """
+
+    __slots__ = ["secs", "nanos", "caplen", "wirelen"]
+
+    def __init__(self, secs, nanos, caplen, wirelen):
+        self.secs = secs
+        self.nanos = nanos
+        self.caplen = caplen
+        self.wirelen = wirelen
+
+    def getts(self):
+        return (self.secs, self.nanos / 1000)
+
+    def getts_nanos(self):
+        """ Returns the timestamp in epoch nanoseconds; the ring, unlike libpcap, provides nanosecond precision. """
+        return self.secs * 1000000000 + self.nanos
+
+    def getcaplen(self):
+        return self.caplen
+
+    def getlen(self):
+        return self.wirelen
+
+
+class RingCapture(object):
+    """
+    Captures packets from a memory-mapped TPACKET_V3 ring shared with the kernel.  This mimics the
+    capture handle returned by pcapy, but each packet is a read-only buffer that references the ring,
+    rather than a copy of the packet.  A packet remains valid only until the next call to 'dispatch'
+    or 'next', at which point the block containing it may be handed back to the kernel.
+    """
+
+    # the timestamp precision of the packet headers
+    precision = NANOS
+
+    def __init__(self, interface, snaplen, promisc, timeout_ms, ring_size_mb=64, block_size=1 << 20,
+                 frame_size=1 << 11):
+        self.snaplen = snaplen
+        self.timeout_ms = timeout_ms
+        self.block_size = block_size
+        self.block_nr = max(1, (ring_size_mb << 20) / block_size)
+        self.pkts_recv = 0
+        self.pkts_drop = 0
+
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+        try:
+            # setup the ring; blocks are retired to user space when full or after the read timeout
+            self.sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+            frame_nr = (self.block_size * self.block_nr) / frame_size
+            request = RING_REQUEST.pack(self.block_size, self.block_nr, frame_size, frame_nr, timeout_ms, 0, 0)
+            self.sock.setsockopt(SOL_PACKET, PACKET_RX_RING, request)
+            self.ring = mmap.mmap(self.sock.fileno(), self.block_size * self.block_nr, mmap.MAP_SHARED,
+                                  mmap.PROT_READ | mmap.PROT_WRITE)
+
+            self.sock.bind((interface, ETH_P_ALL))
+            if promisc:
+                ifreq = fcntl.ioctl(self.sock.fileno(), SIOCGIFINDEX, struct.pack("16sI", interface, 0))
+                ifindex = struct.unpack_from("16sI", ifreq)[1]
+                self.sock.setsockopt(SOL_PACKET, PACKET_ADD_MEMBERSHIP, struct.pack("IHH8s", ifindex,
+                                     PACKET_MR_PROMISC, 0, ""))
+
+            # truncate packets to the snaplen in the kernel
+            self.setfilter("")
+
+        except:
+            self.sock.close()
+            raise
+
+        self.poller = select.poll()
+        self.poller.register(self.sock.fileno(), select.POLLIN | select.POLLERR)
+
+        # the block currently being read and the next packet within it
+        self.block_idx = 0
+        self.block_held = False
+        self.pkts_left = 0
+        self.pkt_offset = 0
+
+    def getfd(self):
+        """ Returns the file descriptor of the capture socket. """
+
+        return self.sock.fileno()
+
+    def setfilter(self, bpf_filter):
+        """ Compiles a BPF filter expression and attaches it to the capture socket. """
+
+        program = pcapy.compile(pcapy.DLT_EN10MB, self.snaplen, bpf_filter, 1, PCAP_NETMASK_UNKNOWN)
+        instructions = program.get_bpf()
+        code = ctypes.create_string_buffer("".join(struct.pack("HBBI", *insn) for insn in instructions))
+        fprog = struct.pack("HL", len(instructions), ctypes.addressof(code))
+        self.sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+
+    def stats(self):
+        """ Returns the packets received, dropped by the kernel and dropped by the interface. """
+
+        # the kernel resets its counters on each read
+        (pkts, drops, _) = RING_STATS.unpack(self.sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, RING_STATS.size))
+        self.pkts_recv += pkts
+        self.pkts_drop += drops
+        return (self.pkts_recv, self.pkts_drop, 0)
+
+    def next(self):
+        """ Returns the next packet, or (None, '') if none arrives before the read timeout. """
+
+        pkts = []
+        self.dispatch(1, lambda pkt_hdr, pkt_raw: pkts.append((pkt_hdr, pkt_raw)))
+        return pkts[0] if pkts else (None, '')
+
+    def dispatch(self, max_pkts, callback):
+        """ Invokes a callback for up to 'max_pkts' packets and returns the number of packets processed. """
+
+        pkts = 0
+        while pkts < max_pkts:
+
+            # wait for the first block only; otherwise return what is available
+            if self.pkts_left == 0 and not self.next_block(self.timeout_ms if pkts == 0 else 0):
+                break
+
+            (next_offset, secs, nanos, caplen, wirelen, _, mac) = PACKET_HEADER.unpack_from(self.ring, self.pkt_offset)
+            callback(RingHeader(secs, nanos, caplen, wirelen), buffer(self.ring, self.pkt_offset + mac, caplen))
+
+            self.pkt_offset += next_offset
+            self.pkts_left -= 1
+            pkts += 1
+
+        return pkts
+
+    def next_block(self, timeout_ms):
+        """ Hands the current block back to the kernel and waits for the next block to be retired. """
+
+        if self.block_held:
+            struct.pack_into("I", self.ring, self.block_idx * self.block_size + BLOCK_STATUS_OFFSET, TP_STATUS_KERNEL)
+            self.block_held = False
+            self.block_idx = (self.block_idx + 1) % self.block_nr
+
+        block_offset = self.block_idx * self.block_size
+        (status, num_pkts, first_offset) = BLOCK_HEADER.unpack_from(self.ring, block_offset + BLOCK_STATUS_OFFSET)
+        if not status & TP_STATUS_USER:
+            if timeout_ms <= 0 or not self.poller.poll(timeout_ms):
+                return False
+            (status, num_pkts, first_offset) = BLOCK_HEADER.unpack_from(self.ring, block_offset + BLOCK_STATUS_OFFSET)
+            if not status & TP_STATUS_USER:
+                return False
+
+        self.block_held = True
+        self.pkts_left = num_pkts
+        self.pkt_offset = block_offset + first_offset
+        return True
+
+    def close(self):
+        """ Releases the ring and closes the capture socket. """
+
+        self.ring.close()
+        self.sock.close()
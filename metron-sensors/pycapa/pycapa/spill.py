@@ -0,0 +1,208 @@
+#
+#  Licensed to the Apache Software Foundation (ASF) under one or more
+#  contributor license agreements.  See the NOTICE file distributed with
+#  this work for additional information regarding copyright ownership.
+#  The ASF licenses this file to You under the Apache License, Version 2.0
+#  (the "License"); you may not use this file except in compliance with
+#  the License.  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import os
+import mmap
+import struct
+from bundle import packet_count, record_timestamp
+
+# each spilled message is preceded by the length of its key and value and its partition
+RECORD_HEADER = struct.Struct(">IIi")
+
+# marks the end of the used space, before the queue wraps around to the start of the file
+WRAP_MARKER = 0xffffffff
+
+
+class SpillQueue(object):
+    """ A bounded, first-in first-out queue of messages held in a memory-mapped file. """
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.capacity = max_bytes
+        self.file = open(path, "w+b")
+        self.file.truncate(max_bytes)
+        self.mm = mmap.mmap(self.file.fileno(), max_bytes)
+
+        # the offsets of the oldest message and of the free space after the newest message
+        self.head = 0
+        self.tail = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def push(self, key, value, partition=-1):
+        """ Adds a message to the queue; returns false if there is no room for it. """
+
+        size = RECORD_HEADER.size + len(key) + len(value)
+        if self.count == 0:
+            self.head = self.tail = 0
+
+        if self.count == 0 or self.tail > self.head:
+
+            # the free space is at the end of the file, followed by the start of the file
+            if self.capacity - self.tail < size:
+                if self.head < size:
+                    return False
+                if self.capacity - self.tail >= RECORD_HEADER.size:
+                    RECORD_HEADER.pack_into(self.mm, self.tail, WRAP_MARKER, 0, 0)
+                self.tail = 0
+
+        elif self.head - self.tail < size:
+            # the free space is between the newest and the oldest message
+            return False
+
+        # the key and value may be strings, buffers or byte arrays
+        self.mm.seek(self.tail)
+        self.mm.write(RECORD_HEADER.pack(len(key), len(value), partition))
+        self.mm.write(buffer(key))
+        self.mm.write(buffer(value))
+        self.tail += size
+        self.count += 1
+        return True
+
+    def peek(self):
+        """ Returns the key, value and partition of the oldest message, without removing it. """
+
+        if self.count == 0:
+            return None
+
+        # wrap around if the oldest message is at the start of the file
+        if self.capacity - self.head < RECORD_HEADER.size:
+            self.head = 0
+        (key_len, value_len, partition) = RECORD_HEADER.unpack_from(self.mm, self.head)
+        if key_len == WRAP_MARKER:
+            self.head = 0
+            (key_len, value_len, partition) = RECORD_HEADER.unpack_from(self.mm, self.head)
+
+        start = self.head + RECORD_HEADER.size
+        return (self.mm[start:start + key_len], self.mm[start + key_len:start + key_len + value_len], partition)
+
+    def remove(self):
+        """ Removes the oldest message. """
+
+        (key, value, _) = self.peek()
+        self.head += RECORD_HEADER.size + len(key) + len(value)
+        self.count -= 1
+
+    def close(self):
+        """ Closes and deletes the file backing the queue. """
+
+        self.mm.close()
+        self.file.close()
+        os.remove(self.path)
+
+
+class SpillingProducer(object):
+    """
+    Sends messages to Kafka.  If the producer queue nears its limit, messages are spilled to a bounded
+    queue on disk and drained back to Kafka once the producer catches up.  Messages are dropped only if
+    both the producer queue and the spill queue are full.
+    """
+
+    def __init__(self, kafka_producer, topic, callback, spill=None, max_queued=100000):
+        self.kafka_producer = kafka_producer
+        self.topic = topic
+        self.callback = callback
+        self.spill = spill
+        self.high_watermark = max_queued * 9 / 10
+        self.low_watermark = max_queued / 2
+        self.pkts_sent = 0
+        self.msgs_sent = 0
+        self.pkts_spilled = 0
+        self.pkts_dropped = 0
+
+    def __len__(self):
+        return len(self.kafka_producer) + (len(self.spill) if self.spill is not None else 0)
+
+    def pkts_queued(self):
+        """ Estimates the number of packets in the producer queue, which holds messages rather than packets. """
+
+        if self.msgs_sent == 0:
+            return 0
+        return len(self.kafka_producer) * self.pkts_sent / self.msgs_sent
+
+    def partitions(self, timeout=10.0):
+        """ Returns the number of partitions in the topic. """
+
+        metadata = self.kafka_producer.list_topics(self.topic, timeout=timeout)
+        return len(metadata.topics[self.topic].partitions)
+
+    def produce(self, key, value, pkts=1, partition=-1):
+        """ Sends a message containing one or more packets to Kafka, or spills it if Kafka has fallen behind. """
+
+        # once spilling, keep spilling until the queue drains, so that messages remain in order
+        if self.spill is not None and (len(self.spill) > 0 or len(self.kafka_producer) >= self.high_watermark):
+            self.spill_message(key, value, pkts, partition)
+            return
+
+        # the record timestamp is when the packets were captured rather than sent, so that a time window finds
+        # them by capture time, even when they were replayed from a pcap file or spilled
+        try:
+            self.kafka_producer.produce(self.topic, key=key, value=value, partition=partition,
+                                        timestamp=record_timestamp(key), callback=self.callback)
+            self.pkts_sent += pkts
+            self.msgs_sent += 1
+        except BufferError:
+            if self.spill is not None:
+                self.spill_message(key, value, pkts, partition)
+            else:
+                self.pkts_dropped += pkts
+
+    def spill_message(self, key, value, pkts, partition):
+        """ Adds a message to the spill queue, or drops it if the queue is full. """
+
+        if self.spill.push(key, value, partition):
+            self.pkts_spilled += pkts
+        else:
+            self.pkts_dropped += pkts
+
+    def drain(self):
+        """ Sends spilled messages to Kafka, once its queue has fallen below the low watermark. """
+
+        if self.spill is None or len(self.spill) == 0 or len(self.kafka_producer) > self.low_watermark:
+            return
+
+        while len(self.spill) > 0 and len(self.kafka_producer) < self.high_watermark:
+            (key, value, partition) = self.spill.peek()
+            try:
+                self.kafka_producer.produce(self.topic, key=key, value=value, partition=partition,
+                                            timestamp=record_timestamp(key), callback=self.callback)
+            except BufferError:
+                break
+            self.spill.remove()
+            self.pkts_sent += packet_count(key)
+            self.msgs_sent += 1
+
+    def poll(self, timeout=0):
+        """ Serves the delivery callback queue. """
+
+        return self.kafka_producer.poll(timeout)
+
+    def flush(self):
+        """ Sends all spilled and queued messages to Kafka. """
+
+        while self.spill is not None and len(self.spill) > 0:
+            self.drain()
+            self.kafka_producer.poll(0.1)
+
+        self.kafka_producer.flush()
+
+    def close(self):
+        """ Releases the spill queue. """
+
+        if self.spill is not None:
+            self.spill.close()
@@ -0,0 +1,199 @@
+#
+#  Licensed to the Apache Software Foundation (ASF) under one or more
+#  contributor license agreements.  See the NOTICE file distributed with
+#  this work for additional information regarding copyright ownership.
+#  The ASF licenses this file to You under the Apache License, Version 2.0
+#  (the "License"); you may not use this file except in compliance with
+#  the License.  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import os
+import json
+import time
+import random
+import logging
+import threading
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+
+def percentile(values, pct):
+    """ Returns the percentile of a sorted list of values. """
+
+    if len(values) == 0:
+        return None
+    return values[min(len(values) - 1, int(len(values) * pct / 100.0))]
+
+
+class ProducerStats(object):
+    """
+    Periodically reports the throughput of the producer along with the packets dropped by the kernel,
+    the depth of the Kafka producer queue, delivery latencies and delivery errors.  Each report is
+    written as JSON to a file and/or served from a local HTTP endpoint.
+
+    Delivery latencies are sampled from each delivered message, if every delivery is reported.
+    Otherwise, the bytes delivered are taken from the statistics of the Kafka client and the latencies
+    are estimated from them, as the time spent queued in the client plus the round-trip to the broker.
+    """
+
+    def __init__(self, interval_secs, path=None, port=None, max_samples=1024):
+        self.interval_secs = interval_secs
+        self.path = path
+        self.max_samples = max_samples
+        self.snapshot = {}
+
+        # counters updated as messages are delivered
+        self.bytes_out = 0
+        self.errors = 0
+        self.latencies = []
+        self.deliveries = 0
+
+        # the latest statistics reported by the kafka client
+        self.kafka_latency_ms = {}
+
+        # the counters as of the last report
+        self.last_time = time.time()
+        self.last_pkts_in = 0
+        self.last_pkts_out = 0
+        self.last_bytes_out = 0
+
+        self.server = None
+        if port is not None:
+            self.server = StatsServer(("localhost", port), self)
+            thread = threading.Thread(target=self.server.serve_forever)
+            thread.daemon = True
+            thread.start()
+
+    def record_delivery(self, msg):
+        """ Records the delivery of a message. """
+
+        self.bytes_out += len(msg.value())
+
+        # the latency since the message was produced; keep a uniform sample of these each interval.  the
+        # record timestamp is the capture time, so the latency is taken from the kafka client instead
+        latency = msg.latency()
+        if latency is not None:
+            self.deliveries += 1
+            latency_ms = latency * 1000
+            if len(self.latencies) < self.max_samples:
+                self.latencies.append(latency_ms)
+            else:
+                idx = random.randint(0, self.deliveries - 1)
+                if idx < self.max_samples:
+                    self.latencies[idx] = latency_ms
+
+    def record_error(self):
+        """ Records a failed delivery. """
+
+        self.errors += 1
+
+    def record_kafka_stats(self, stats_json):
+        """ Records the statistics periodically reported by the kafka client. """
+
+        kafka_stats = json.loads(stats_json)
+        self.bytes_out = kafka_stats.get("txmsg_bytes", self.bytes_out)
+
+        # the delivery latency through the slowest broker, in microseconds; the time spent in the producer
+        # queue, including any linger, then in the request queue, then the round-trip to the broker.  each
+        # is a separate window of samples, so the sum of their percentiles is an estimate
+        stages = ["int_latency", "outbuf_latency", "rtt"]
+        brokers = [broker for broker in kafka_stats.get("brokers", {}).values()
+                   if broker.get("rtt", {}).get("cnt")]
+        if brokers:
+            self.kafka_latency_ms = dict(
+                (pct, max(sum(broker.get(stage, {}).get(pct, 0) for stage in stages) for broker in brokers) / 1000.0)
+                for pct in ["p50", "p95", "p99", "max"])
+
+    def update(self, pkts_in, pkts_out, capture, kafka_producer, force=False):
+        """ Reports the statistics, if the reporting interval has elapsed. """
+
+        now = time.time()
+        elapsed = now - self.last_time
+        if elapsed < self.interval_secs and not force:
+            return
+        elapsed = max(elapsed, 0.001)
+
+        (pkts_recv, pkts_drop, pkts_ifdrop) = capture.stats()
+        latencies = sorted(self.latencies)
+        if latencies:
+            latency_ms = {
+                "p50": percentile(latencies, 50),
+                "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99),
+                "max": latencies[-1]
+            }
+        else:
+            latency_ms = self.kafka_latency_ms
+
+        self.snapshot = {
+            "timestamp": now,
+            "interval_secs": elapsed,
+            "pkts_in": pkts_in,
+            "pkts_out": pkts_out,
+            "bytes_out": self.bytes_out,
+            "pkts_in_per_sec": (pkts_in - self.last_pkts_in) / elapsed,
+            "pkts_out_per_sec": (pkts_out - self.last_pkts_out) / elapsed,
+            "bytes_out_per_sec": (self.bytes_out - self.last_bytes_out) / elapsed,
+            "kernel_pkts_recv": pkts_recv,
+            "kernel_pkts_drop": pkts_drop,
+            "interface_pkts_drop": pkts_ifdrop,
+            "queue_depth": len(kafka_producer),
+            "pkts_spilled": kafka_producer.pkts_spilled,
+            "pkts_dropped": kafka_producer.pkts_dropped,
+            "delivery_errors": self.errors,
+            "delivery_latency_ms": latency_ms
+        }
+        logging.debug("Producer stats; %s", self.snapshot)
+
+        if self.path is not None:
+            self.write(self.snapshot)
+
+        self.last_time = now
+        self.last_pkts_in = pkts_in
+        self.last_pkts_out = pkts_out
+        self.last_bytes_out = self.bytes_out
+        self.latencies = []
+        self.deliveries = 0
+
+    def write(self, snapshot):
+        """ Replaces the stats file, so that a reader never sees a partial report. """
+
+        tmp_path = "%s.tmp" % self.path
+        with open(tmp_path, "w") as f:
+            json.dump(snapshot, f)
+        os.rename(tmp_path, self.path)
+
+    def close(self):
+        """ Stops serving the statistics. """
+
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+class StatsServer(HTTPServer):
+    """ Serves the latest statistics as JSON. """
+
+    def __init__(self, address, stats):
+        HTTPServer.__init__(self, address, StatsRequestHandler)
+        self.stats = stats
+
+
+class StatsRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        body = json.dumps(self.server.stats.snapshot)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug("Stats request; %s", format % args)
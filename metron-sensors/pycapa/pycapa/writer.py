@@ -0,0 +1,264 @@
+#
+#  Licensed to the Apache Software Foundation (ASF) under one or more
+#  contributor license agreements.  See the NOTICE file distributed with
+#  this work for additional information regarding copyright ownership.
+#  The ASF licenses this file to You under the Apache License, Version 2.0
+#  (the "License"); you may not use this file except in compliance with
+#  the License.  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import os
+import gzip
+import shutil
+import struct
+import threading
+import Queue
+import time
+import logging
+
+# the 'ts_sec', 'ts_frac', 'incl_len' and 'orig_len' fields that precede each packet in a libpcap file
+PACKET_HEADER = struct.Struct("IIII")
+
+# a file is written under a temporary name until it is closed, so that only complete files carry the suffix
+PARTIAL_SUFFIX = ".part"
+
+
+def compress_file(path):
+    """ Compresses a file with gzip, then removes the original. """
+
+    with open(path, "rb") as src:
+        with gzip.open(path + ".gz", "wb") as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+    os.remove(path)
+
+
+class Compressor(object):
+    """ Compresses closed files in a background thread, so that writing need not wait. """
+
+    def __init__(self):
+        self.pending = Queue.Queue()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, path):
+        """ Queues a file to be compressed. """
+
+        self.pending.put(path)
+
+    def run(self):
+        while True:
+            path = self.pending.get()
+            if path is None:
+                break
+            try:
+                compress_file(path)
+                logging.debug("Compressed pcap file; path=%s.gz", path)
+            except EnvironmentError as e:
+                logging.error("Unable to compress '%s'; %s", path, e)
+
+    def close(self):
+        """ Waits for all queued files to be compressed. """
+
+        self.pending.put(None)
+        self.thread.join()
+
+
+class PcapStream(object):
+    """
+    Writes packets to a libpcap stream through a reusable buffer.  Each packet header is packed directly
+    into the buffer, followed by the packet, and the buffer is written out once full or, when
+    'flush_if_due' is called, once the oldest packet in it has waited long enough.
+    """
+
+    def __init__(self, stream, precision, buffer_size=1 << 20, max_ms=100, close_stream=False):
+        self.stream = stream
+        self.close_stream = close_stream
+        self.precision = precision
+        self.buf = bytearray(buffer_size)
+        self.capacity = buffer_size
+        self.used = 0
+        self.max_secs = max_ms / 1000.0
+        self.buffered = None
+        self.pack_header = PACKET_HEADER.pack_into
+
+    def write(self, ts, wirelen, pkt_raw):
+        """ Writes a packet, preceded by its packet header. """
+
+        caplen = len(pkt_raw)
+        start = self.used
+        end = start + PACKET_HEADER.size + caplen
+        if end > self.capacity:
+            self.flush()
+            start = 0
+            end = PACKET_HEADER.size + caplen
+            if end > self.capacity:
+                self.buf = bytearray(end)
+                self.capacity = end
+
+        if self.buffered is None:
+            self.buffered = time.time()
+
+        buf = self.buf
+        precision = self.precision
+        self.pack_header(buf, start, ts / precision, ts % precision, caplen, wirelen)
+        buf[start + PACKET_HEADER.size:end] = pkt_raw
+        self.used = end
+
+    def flush_if_due(self, now=None):
+        """ Writes out the buffer once the oldest packet in it has waited long enough. """
+
+        if self.buffered is not None and (now or time.time()) - self.buffered >= self.max_secs:
+            self.flush()
+
+    def flush(self):
+        """ Writes out the buffer. """
+
+        if self.used > 0:
+            self.stream.write(buffer(self.buf, 0, self.used))
+            self.stream.flush()
+            self.used = 0
+        self.buffered = None
+
+    def close(self):
+        """ Writes out the buffer; the stream itself is left open, unless it belongs to this writer. """
+
+        self.flush()
+        if self.close_stream:
+            self.stream.close()
+
+
+class RotatingPcapWriter(object):
+    """
+    Writes packets to a series of libpcap files in a directory, starting a new file once the current
+    file reaches a maximum size or age.  Writes are buffered, so that many packets are written with
+    each system call, rather than one or more calls per packet.
+    """
+
+    def __init__(self, directory, global_header, precision, max_bytes, max_secs, compress=False,
+                 prefix="pycapa", buffer_size=1 << 20, max_ms=100):
+        self.directory = directory
+        self.global_header = global_header
+        self.precision = precision
+        self.max_bytes = max_bytes
+        self.max_secs = max_secs
+        self.prefix = prefix
+        self.buffer_size = buffer_size
+        self.max_ms = max_ms
+        self.compressor = Compressor() if compress else None
+        self.file = None
+        self.stream = None
+        self.path = None
+        self.file_bytes = 0
+        self.opened = 0
+        self.files = 0
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def open(self):
+        """ Starts a new file, beginning with the global header. """
+
+        now = time.time()
+        name = "%s-%s-%d.pcap" % (self.prefix, time.strftime("%Y%m%d%H%M%S", time.gmtime(now)), self.files)
+        self.path = os.path.join(self.directory, name)
+        self.file = open(self.path + PARTIAL_SUFFIX, "wb", 0)
+        self.file.write(self.global_header)
+        self.stream = PcapStream(self.file, self.precision, self.buffer_size, self.max_ms)
+        self.file_bytes = len(self.global_header)
+        self.opened = now
+        self.files += 1
+        logging.debug("Writing pcap file; path=%s", self.path)
+
+    def write(self, ts, wirelen, pkt_raw):
+        """ Writes a packet, preceded by its packet header. """
+
+        if self.file is None:
+            self.open()
+
+        self.stream.write(ts, wirelen, pkt_raw)
+        self.file_bytes += PACKET_HEADER.size + len(pkt_raw)
+        if self.file_bytes >= self.max_bytes:
+            self.rotate()
+
+    def flush_if_due(self, now=None):
+        """
+        Closes the current file once it reaches its maximum age, even if no more packets arrive, and
+        writes out any packets that have waited long enough.
+        """
+
+        if self.file is None:
+            return
+
+        now = now or time.time()
+        if self.max_secs > 0 and now - self.opened >= self.max_secs:
+            self.rotate()
+        else:
+            self.stream.flush_if_due(now)
+
+    def rotate(self):
+        """ Closes the current file; the next packet written starts a new file. """
+
+        if self.file is None:
+            return
+
+        self.stream.flush()
+        self.file.close()
+        os.rename(self.path + PARTIAL_SUFFIX, self.path)
+        logging.info("Closed pcap file; path=%s, bytes=%d", self.path, self.file_bytes)
+        if self.compressor is not None:
+            self.compressor.submit(self.path)
+        self.file = None
+        self.stream = None
+
+    def close(self):
+        """ Closes the current file and waits for any compression to finish. """
+
+        self.rotate()
+        if self.compressor is not None:
+            self.compressor.close()
+
+
+class FilteredWriter(object):
+    """ Writes only the packets that match a compiled BPF filter. """
+
+    def __init__(self, program, writer):
+        self.program = program
+        self.writer = writer
+
+    def write(self, ts, wirelen, pkt_raw):
+        if self.program.filter(pkt_raw):
+            self.writer.write(ts, wirelen, pkt_raw)
+
+    def flush_if_due(self, now=None):
+        self.writer.flush_if_due(now)
+
+    def close(self):
+        self.writer.close()
+
+
+class TeeWriter(object):
+    """ Writes each packet to multiple writers, so that a single read can produce several extractions. """
+
+    def __init__(self, writers):
+        self.writers = writers
+
+    def write(self, ts, wirelen, pkt_raw):
+        for writer in self.writers:
+            writer.write(ts, wirelen, pkt_raw)
+
+    def flush_if_due(self, now=None):
+        now = now or time.time()
+        for writer in self.writers:
+            writer.flush_if_due(now)
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()